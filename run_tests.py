@@ -7,6 +7,7 @@ Run all tests or specific test categories
 import sys
 import pytest
 import argparse
+import importlib.util
 
 
 def main():
@@ -23,6 +24,11 @@ def main():
         action='store_true',
         help='Verbose output'
     )
+    parser.add_argument(
+        '--workers',
+        '-n',
+        help='Run tests in parallel worker processes, a count or "auto" (needs pytest-xdist)'
+    )
     parser.add_argument(
         '--generate-data',
         action='store_true',
@@ -37,6 +43,14 @@ def main():
     if args.verbose:
         pytest_args.append('-v')
     
+    if args.workers:
+        if importlib.util.find_spec('xdist') is None:
+            print("pytest-xdist is not installed, running tests in a single process")
+        else:
+            # Every worker builds its own in-memory test app; loadscope keeps
+            # class-scoped fixtures on one worker
+            pytest_args.extend(['-n', args.workers, '--dist', 'loadscope'])
+    
     # Add specific test files based on type
     if args.type == 'unit':
         pytest_args.extend([
@@ -47,7 +61,10 @@ def main():
     elif args.type == 'integration':
         pytest_args.append('tests/test_recommendation_integration.py')
     elif args.type == 'performance':
-        pytest_args.append('tests/test_performance_benchmarks.py')
+        pytest_args.extend([
+            'tests/test_performance_benchmarks.py',
+            'tests/test_query_counts.py'
+        ])
     elif args.type == 'metrics':
         pytest_args.append('tests/test_metrics.py')
     else:  # all
@@ -1,11 +1,15 @@
+import click
 from flask import Flask
 from flask_login import LoginManager
 from .config import Config
 from .models import db, User
 
-def create_app():
+def create_app(test_config=None):
     app = Flask(__name__)
     app.config.from_object(Config)
+    if test_config is not None:
+        # Must be applied before init_app, which builds the engine from the config
+        app.config.update(test_config)
     
     db.init_app(app)
     
@@ -34,6 +38,19 @@ def create_app():
     with app.app_context():
         db.create_all()
     
+    # Shared service objects, built once per app instead of once per request
+    from .offers import OfferGenerator
+    from .analytics import AnalyticsEngine
+    app.extensions['offer_generator'] = OfferGenerator()
+    app.extensions['analytics'] = AnalyticsEngine()
+    
+    @app.cli.command('seed')
+    def seed():
+        """Insert sample products into an empty database"""
+        from .sample_data import seed_sample_products
+        added = seed_sample_products()
+        click.echo(f"Added {added} sample products")
+    
     return app
 
 app = create_app()
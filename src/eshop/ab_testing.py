@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
 from enum import Enum
 from dataclasses import dataclass
+from sqlalchemy import func
 from .models import db
 
 
@@ -171,10 +172,15 @@ class ABTestingFramework:
         ).first()
         
         if not result:
+            # Column defaults only apply on INSERT, so start the counters here
             result = ABTestResult(
                 experiment_id=experiment_id,
                 user_id=user_id,
-                variant=variant
+                variant=variant,
+                recommendations_shown=0,
+                clicks=0,
+                purchases=0,
+                revenue=0.0
             )
             db.session.add(result)
         
@@ -204,22 +210,33 @@ class ABTestingFramework:
         
         results = {}
         
+        # Aggregate results for every variant in one grouped query
+        totals = {
+            row.variant: row for row in db.session.query(
+                ABTestResult.variant,
+                func.count(ABTestResult.id).label('users'),
+                func.coalesce(func.sum(ABTestResult.clicks), 0).label('clicks'),
+                func.coalesce(func.sum(ABTestResult.purchases), 0).label('purchases'),
+                func.coalesce(func.sum(ABTestResult.revenue), 0.0).label('revenue'),
+                func.coalesce(func.sum(ABTestResult.recommendations_shown), 0).label('shown')
+            ).filter(
+                ABTestResult.experiment_id == experiment_id
+            ).group_by(ABTestResult.variant)
+        }
+        
         # Get results by variant
         variant_data = {}
         for variant in experiment.variants:
-            variant_results = ABTestResult.query.filter_by(
-                experiment_id=experiment_id,
-                variant=variant['name']
-            ).all()
+            row = totals.get(variant['name'])
             
-            if variant_results:
+            if row:
                 variant_data[variant['name']] = {
-                    'users': len(variant_results),
-                    'clicks': sum(r.clicks for r in variant_results),
-                    'purchases': sum(r.purchases for r in variant_results),
-                    'revenue': sum(r.revenue for r in variant_results),
-                    'ctr': sum(r.clicks for r in variant_results) / max(sum(r.recommendations_shown for r in variant_results), 1),
-                    'conversion_rate': sum(r.purchases for r in variant_results) / max(len(variant_results), 1)
+                    'users': row.users,
+                    'clicks': row.clicks,
+                    'purchases': row.purchases,
+                    'revenue': row.revenue,
+                    'ctr': row.clicks / max(row.shown, 1),
+                    'conversion_rate': row.purchases / max(row.users, 1)
                 }
         
         # Calculate significance between control and treatment
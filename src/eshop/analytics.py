@@ -60,43 +60,53 @@ class AnalyticsEngine:
             )
             db.session.add(best_seller)
         
-        # Calculate category-specific best sellers
-        categories = db.session.query(Product.category).distinct().all()
-        for (category,) in categories:
-            category_sales = db.session.query(
-                OrderItem.product_id,
-                func.sum(OrderItem.quantity).label('sales_count'),
-                func.sum(OrderItem.quantity * OrderItem.price).label('revenue')
-            ).join(
-                Order, OrderItem.order_id == Order.id
-            ).join(
-                Product, OrderItem.product_id == Product.id
-            ).filter(
-                and_(
-                    Order.created_at >= start_date,
-                    Product.category == category
-                )
-            ).group_by(
-                OrderItem.product_id
-            ).order_by(
-                func.sum(OrderItem.quantity).desc()
-            ).limit(20).all()  # Top 20 per category
-            
-            # Clear existing category entries
-            BestSeller.query.filter_by(time_window=time_window, category=category).delete()
-            
-            # Insert category best sellers
-            for rank, (product_id, sales_count, revenue) in enumerate(category_sales, 1):
-                best_seller = BestSeller(
-                    product_id=product_id,
-                    category=category,
-                    time_window=time_window,
-                    sales_count=sales_count,
-                    revenue=revenue,
-                    rank=rank,
-                    last_calculated=now
-                )
-                db.session.add(best_seller)
+        # Rank every category's best sellers in one windowed query instead of one query per category
+        sales_count = func.sum(OrderItem.quantity)
+        ranked_sales = db.session.query(
+            Product.category,
+            OrderItem.product_id,
+            sales_count.label('sales_count'),
+            func.sum(OrderItem.quantity * OrderItem.price).label('revenue'),
+            func.row_number().over(
+                partition_by=Product.category,
+                order_by=sales_count.desc()
+            ).label('rank')
+        ).join(
+            Order, OrderItem.order_id == Order.id
+        ).join(
+            Product, OrderItem.product_id == Product.id
+        ).filter(
+            and_(
+                Order.created_at >= start_date,
+                Product.category.isnot(None)
+            )
+        ).group_by(
+            Product.category,
+            OrderItem.product_id
+        ).subquery()
+        
+        category_sales = db.session.query(ranked_sales).filter(
+            ranked_sales.c.rank <= 20  # Top 20 per category
+        ).all()
+        
+        # Clear existing category entries
+        BestSeller.query.filter(
+            BestSeller.time_window == time_window,
+            BestSeller.category.isnot(None)
+        ).delete()
+        
+        # Insert category best sellers
+        for category, product_id, sales_count, revenue, rank in category_sales:
+            best_seller = BestSeller(
+                product_id=product_id,
+                category=category,
+                time_window=time_window,
+                sales_count=sales_count,
+                revenue=revenue,
+                rank=rank,
+                last_calculated=now
+            )
+            db.session.add(best_seller)
         
         db.session.commit()
     
@@ -273,7 +283,7 @@ class AnalyticsEngine:
         query = BestSeller.query.filter_by(
             time_window=time_window,
             category=category
-        ).order_by(BestSeller.rank)
+        ).options(db.joinedload(BestSeller.product)).order_by(BestSeller.rank)
         
         if limit:
             query = query.limit(limit)
@@ -288,13 +298,33 @@ class AnalyticsEngine:
         """
         query = TrendingProduct.query.filter_by(
             category=category
-        ).order_by(TrendingProduct.rank)
+        ).options(db.joinedload(TrendingProduct.product)).order_by(TrendingProduct.rank)
         
         if limit:
             query = query.limit(limit)
         
         return [tp.product for tp in query.all()]
     
+    @staticmethod
+    @cached_recommendation(ttl=900)  # Cache for 15 minutes
+    def get_trending_deals(category=None, limit=10):
+        """
+        Retrieve the top trending products that are discounted or low in stock.
+        The deal filter runs in SQL over the top `limit` trending entries.
+        """
+        top_trending = db.session.query(
+            TrendingProduct.product_id,
+            TrendingProduct.rank
+        ).filter(
+            TrendingProduct.category == category
+        ).order_by(TrendingProduct.rank).limit(limit).subquery()
+        
+        return Product.query.join(
+            top_trending, Product.id == top_trending.c.product_id
+        ).filter(
+            or_(Product.discount_percentage > 0, Product.stock_quantity < 10)
+        ).order_by(top_trending.c.rank).all()
+    
     @staticmethod
     def update_analytics():
         """
@@ -1,9 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timezone
 from .models import db, Order, OrderItem, Product, PersonalizedOffer
 from .session_manager import SessionManager
-from .offers import OfferGenerator
 
 checkout = Blueprint('checkout', __name__)
 
@@ -18,7 +17,7 @@ def checkout_page():
         return redirect(url_for('main.home'))
     
     cart_items = cart.items.all()
-    offer_generator = OfferGenerator()
+    offer_generator = current_app.extensions['offer_generator']
     
     # Calculate total with personalized offers
     total = 0
@@ -70,7 +69,7 @@ def process_checkout():
     db.session.flush()  # Get order ID
     
     # Create order items and update stock
-    offer_generator = OfferGenerator()
+    offer_generator = current_app.extensions['offer_generator']
     
     for cart_item in cart.items:
         # Check for personalized offers and apply them
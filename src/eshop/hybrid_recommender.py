@@ -4,6 +4,7 @@ with configurable weights based on user data availability.
 """
 
 import numpy as np
+from sqlalchemy import func
 from .models import db, UserInteraction, Order, Product
 from .ml_recommenders import LinearSVMRecommender, AdvancedNeighborsRecommender
 from .shopping_cart_recommender import ShoppingCartRecommender
@@ -42,13 +43,15 @@ class HybridRecommender:
             }
         }
     
-    def get_recommendations(self, user_id, limit=10):
+    def get_recommendations(self, user_id, limit=10, *, precomputed_user_vec=None):
         """
         Get hybrid recommendations for a user based on their data profile
         
         Args:
             user_id: User ID
             limit: Number of recommendations to return
+            precomputed_user_vec: Result of svm_recommender.build_user_vector(user_id),
+                passed on to the SVM for established users
             
         Returns:
             List of recommended products
@@ -66,13 +69,91 @@ class HybridRecommender:
         elif user_segment == 'minimal_data':
             return self._get_minimal_data_recommendations(user_id, candidate_products, limit)
         else:  # established_user
-            return self._get_established_user_recommendations(user_id, candidate_products, limit)
+            return self._get_established_user_recommendations(
+                user_id, candidate_products, limit, precomputed_user_vec=precomputed_user_vec
+            )
+    
+    def get_recommendations_batch(self, user_ids, limit=10):
+        """
+        Get hybrid recommendations for several users at once
+        
+        Segments all users with two grouped count queries and loads the
+        shared best seller/trending pool and candidate products once,
+        instead of repeating that work for every user.
+        
+        Args:
+            user_ids: List of user IDs
+            limit: Number of recommendations per user
+            
+        Returns:
+            Dict mapping each user ID to its list of recommended products
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        
+        segments = self._determine_user_segments(user_ids)
+        
+        new_user_pool = None
+        candidate_products = None
+        recommendations = {}
+        
+        for user_id in user_ids:
+            user_segment = segments[user_id]
+            
+            if user_segment == 'new_user':
+                if new_user_pool is None:
+                    new_user_pool = self._get_new_user_pool(limit)
+                pool = list(new_user_pool)
+                np.random.shuffle(pool)
+                recommendations[user_id] = pool[:limit]
+            elif user_segment == 'minimal_data':
+                recommendations[user_id] = self._get_minimal_data_recommendations(
+                    user_id, candidate_products, limit
+                )
+            else:  # established_user
+                if candidate_products is None:
+                    candidate_products = Product.query.filter(
+                        Product.stock_quantity > 0
+                    ).all()
+                recommendations[user_id] = self._get_established_user_recommendations(
+                    user_id, candidate_products, limit
+                )
+        
+        return recommendations
     
     def _determine_user_segment(self, user_id):
         """Determine which recommendation strategy to use based on user data"""
         interaction_count = UserInteraction.query.filter_by(user_id=user_id).count()
         purchase_count = db.session.query(Order).filter_by(user_id=user_id).count()
         
+        return self._segment_for_counts(interaction_count, purchase_count)
+    
+    def _determine_user_segments(self, user_ids):
+        """Map each user ID to its segment using one grouped count per table"""
+        interaction_counts = dict(
+            db.session.query(UserInteraction.user_id, func.count(UserInteraction.id))
+            .filter(UserInteraction.user_id.in_(user_ids))
+            .group_by(UserInteraction.user_id)
+            .all()
+        )
+        purchase_counts = dict(
+            db.session.query(Order.user_id, func.count(Order.id))
+            .filter(Order.user_id.in_(user_ids))
+            .group_by(Order.user_id)
+            .all()
+        )
+        
+        return {
+            user_id: self._segment_for_counts(
+                interaction_counts.get(user_id, 0),
+                purchase_counts.get(user_id, 0)
+            )
+            for user_id in user_ids
+        }
+    
+    def _segment_for_counts(self, interaction_count, purchase_count):
+        """Pick the user segment for the given interaction and order counts"""
         if interaction_count < 5:
             return 'new_user'
         elif interaction_count < 20 or purchase_count < 2:
@@ -82,6 +163,13 @@ class HybridRecommender:
     
     def _get_new_user_recommendations(self, limit):
         """Get recommendations for new users (best sellers + trending)"""
+        recommendations = self._get_new_user_pool(limit)
+        np.random.shuffle(recommendations)
+        
+        return recommendations[:limit]
+    
+    def _get_new_user_pool(self, limit):
+        """Get the unshuffled best sellers + trending pool for new users"""
         weights = self.weights['new_user']
         
         # Get best sellers
@@ -97,11 +185,7 @@ class HybridRecommender:
             limit=trending_count
         )
         
-        # Combine and shuffle
-        recommendations = best_sellers + trending
-        np.random.shuffle(recommendations)
-        
-        return recommendations[:limit]
+        return best_sellers + trending
     
     def _get_minimal_data_recommendations(self, user_id, candidate_products, limit):
         """Get recommendations for users with minimal data (cold start)"""
@@ -109,7 +193,7 @@ class HybridRecommender:
         from .recommender import Recommender
         return Recommender.get_cold_start_recommendations(user_id, limit)
     
-    def _get_established_user_recommendations(self, user_id, candidate_products, limit):
+    def _get_established_user_recommendations(self, user_id, candidate_products, limit, precomputed_user_vec=None):
         """Get recommendations for established users using all algorithms"""
         weights = self.weights['established_user']
         
@@ -119,7 +203,7 @@ class HybridRecommender:
         # Linear SVM recommendations
         if weights['linear_svm'] > 0:
             svm_recs = self.svm_recommender.get_recommendations(
-                user_id, candidate_products, limit=limit*2
+                user_id, candidate_products, limit=limit*2, precomputed_user_vec=precomputed_user_vec
             )
             for i, product in enumerate(svm_recs):
                 if product.id not in all_recommendations:
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 from sklearn.svm import LinearSVC
 from sklearn.preprocessing import StandardScaler
@@ -5,8 +6,8 @@ from sklearn.model_selection import train_test_split
 from collections import defaultdict
 from datetime import datetime, timedelta
 from .models import db, Product, UserInteraction, Order, OrderItem, User
-from sqlalchemy import func, and_
-from .shopping_cart_recommender import ShoppingCartRecommender
+from sqlalchemy import case, func, and_
+from .shopping_cart_recommender import ShoppingCartRecommender, _top_k_indices
 
 
 class LinearSVMRecommender:
@@ -21,7 +22,7 @@ class LinearSVMRecommender:
         self.category_encoder = {}
         self.brand_encoder = {}
         
-    def get_recommendations(self, user_id, candidate_products, limit=10):
+    def get_recommendations(self, user_id, candidate_products, limit=10, *, precomputed_user_vec=None):
         """
         Get product recommendations for a user using Linear SVM
         
@@ -29,6 +30,8 @@ class LinearSVMRecommender:
             user_id: User ID
             candidate_products: List of products to rank
             limit: Number of recommendations to return
+            precomputed_user_vec: Result of build_user_vector(user_id), to
+                reuse when the same user is scored several times
             
         Returns:
             List of recommended products sorted by preference score
@@ -38,35 +41,53 @@ class LinearSVMRecommender:
         if interaction_count < 5:
             return []  # Not enough data for SVM
         
+        # Get user features once for both training and scoring
+        if precomputed_user_vec is None:
+            precomputed_user_vec = self.build_user_vector(user_id)
+        interactions, user_features = precomputed_user_vec
+        
         # Train or load model for user
-        model = self._train_user_model(user_id)
+        model = self._train_user_model(user_id, interactions, user_features)
         if model is None:
             return []
         
-        # Get user features
-        user = User.query.get(user_id)
-        interactions = self._get_user_interactions(user_id)
-        user_features = self._extract_user_features(user, interactions)
+        if not candidate_products:
+            return []
         
-        # Score each candidate product
-        scored_products = []
-        for product in candidate_products:
-            product_features = self._extract_product_features(product)
-            feature_vector = self._create_feature_vector(user_features, product_features)
-            
-            # Get SVM decision score (distance from hyperplane)
-            score = model.decision_function(feature_vector.reshape(1, -1))[0]
+        # Score all candidates with one decision_function call on a stacked feature matrix
+        feature_matrix = np.array([
+            self._create_feature_vector(user_features, self._extract_product_features(product))
+            for product in candidate_products
+        ])
+        
+        # SVM decision scores (distance from hyperplane)
+        scores = model.decision_function(feature_matrix)
+        
+        for product, score in zip(candidate_products, scores):
             product._svm_score = score
-            scored_products.append((score, product))
         
-        # Sort by score and return top products
-        scored_products.sort(key=lambda x: x[0], reverse=True)
-        return [product for _, product in scored_products[:limit]]
+        # Return the top products by score
+        return [candidate_products[i] for i in _top_k_indices(scores, limit)]
+    
+    def build_user_vector(self, user_id):
+        """
+        Load a user's recent interactions and derive their feature dict
+        
+        Returns:
+            Tuple of (interactions, user_features) accepted as
+            precomputed_user_vec by get_recommendations
+        """
+        user = User.query.get(user_id)
+        interactions = self._get_user_interactions(user_id)
+        return interactions, self._extract_user_features(user, interactions)
     
     def _get_user_interactions(self, user_id, days_back=90):
         """Get user interactions from the last N days"""
         cutoff_date = datetime.utcnow() - timedelta(days=days_back)
-        return UserInteraction.query.filter(
+        # Feature extraction and training read every interaction's product
+        return UserInteraction.query.options(
+            db.joinedload(UserInteraction.product)
+        ).filter(
             UserInteraction.user_id == user_id,
             UserInteraction.timestamp >= cutoff_date
         ).all()
@@ -191,10 +212,11 @@ class LinearSVMRecommender:
         else:
             return [0, 0, 1]  # High
     
-    def _train_user_model(self, user_id):
-        """Train an SVM model for a specific user"""
+    def _train_user_model(self, user_id, interactions=None, user_features=None):
+        """Train an SVM model for a specific user, reusing already loaded data if given"""
         # Get user interactions
-        interactions = self._get_user_interactions(user_id)
+        if interactions is None:
+            interactions = self._get_user_interactions(user_id)
         if len(interactions) < 10:
             return None  # Not enough data
         
@@ -204,8 +226,9 @@ class LinearSVMRecommender:
             return None  # Not enough positive examples
         
         # Prepare training data
-        user = User.query.get(user_id)
-        user_features = self._extract_user_features(user, interactions)
+        if user_features is None:
+            user = User.query.get(user_id)
+            user_features = self._extract_user_features(user, interactions)
         
         X_train = []
         y_train = []
@@ -247,9 +270,18 @@ class AdvancedNeighborsRecommender:
     with multiple similarity metrics and hybrid techniques.
     """
     
-    def __init__(self, min_common_items=2, similarity_threshold=0.1):
+    # Score contributed by each interaction of a given type
+    interaction_weights = {
+        'view': 1.0,
+        'click': 2.0,
+        'add_to_cart': 3.0,
+        'purchase': 5.0
+    }
+    
+    def __init__(self, min_common_items=2, similarity_threshold=0.1, top_k_neighbors=50):
         self.min_common_items = min_common_items
         self.similarity_threshold = similarity_threshold
+        self.top_k_neighbors = top_k_neighbors
         
     def get_recommendations(self, user_id, candidate_products, limit=10):
         """
@@ -270,75 +302,103 @@ class AdvancedNeighborsRecommender:
             user_id, 
             similar_users, 
             candidate_products,
-            limit
+            limit,
+            user_items=user_items
         )
         
         return recommendations
     
     def _get_user_item_interactions(self, user_id):
         """Get all items a user has interacted with and their scores"""
-        interactions = db.session.query(
+        # Weighted scores for each item, summed in SQL
+        item_scores = db.session.query(
             UserInteraction.product_id,
-            UserInteraction.interaction_type,
-            func.count(UserInteraction.id).label('count')
+            self._weighted_score()
         ).filter(
             UserInteraction.user_id == user_id
         ).group_by(
-            UserInteraction.product_id,
-            UserInteraction.interaction_type
+            UserInteraction.product_id
         ).all()
         
-        # Calculate weighted scores for each item
-        item_scores = defaultdict(float)
-        weights = {
-            'view': 1.0,
-            'click': 2.0,
-            'add_to_cart': 3.0,
-            'purchase': 5.0
-        }
+        return dict(item_scores)
+    
+    def _get_users_item_interactions(self, user_ids):
+        """Get the item scores of several users at once, keyed by user"""
+        # One grouped query for all users instead of one per user
+        item_scores = db.session.query(
+            UserInteraction.user_id,
+            UserInteraction.product_id,
+            self._weighted_score()
+        ).filter(
+            UserInteraction.user_id.in_(user_ids)
+        ).group_by(
+            UserInteraction.user_id,
+            UserInteraction.product_id
+        ).all()
         
-        for product_id, interaction_type, count in interactions:
-            score = weights.get(interaction_type, 1.0) * count
-            item_scores[product_id] += score
+        users_items = defaultdict(dict)
+        for user_id, product_id, score in item_scores:
+            users_items[user_id][product_id] = score
         
-        return dict(item_scores)
+        return users_items
+    
+    def _weighted_score(self):
+        """SQL expression summing interaction weights, i.e. the per-item score"""
+        return func.sum(case(
+            self.interaction_weights,
+            value=UserInteraction.interaction_type,
+            else_=1.0
+        ))
     
     def _find_similar_users(self, user_id, user_items):
         """Find users similar to the target user"""
-        # Get all users who have interacted with at least one common item
-        common_users = db.session.query(
+        # Weighted scores of every other user on the target's items, in one query
+        common_scores = db.session.query(
             UserInteraction.user_id,
-            UserInteraction.product_id
+            UserInteraction.product_id,
+            self._weighted_score()
         ).filter(
             UserInteraction.product_id.in_(user_items.keys()),
             UserInteraction.user_id != user_id
-        ).distinct().all()
+        ).group_by(
+            UserInteraction.user_id,
+            UserInteraction.product_id
+        ).all()
         
         # Group by user
-        user_common_items = defaultdict(set)
-        for other_user_id, product_id in common_users:
-            user_common_items[other_user_id].add(product_id)
-        
-        # Calculate similarity scores
-        similar_users = []
-        for other_user_id, common_products in user_common_items.items():
-            if len(common_products) >= self.min_common_items:
-                # Get the other user's items
-                other_items = self._get_user_item_interactions(other_user_id)
-                
-                # Calculate similarity
-                similarity = self._calculate_user_similarity(
-                    user_items, 
-                    other_items,
-                    common_products
-                )
-                
-                if similarity >= self.similarity_threshold:
-                    similar_users.append((other_user_id, similarity))
-        
-        # Sort by similarity
-        similar_users.sort(key=lambda x: x[1], reverse=True)
-        return similar_users[:50]  # Top 50 most similar users
+        user_common_scores = defaultdict(dict)
+        for other_user_id, product_id, score in common_scores:
+            user_common_scores[other_user_id][product_id] = score
+        
+        candidates = [
+            other_user_id for other_user_id, scores in user_common_scores.items()
+            if len(scores) >= self.min_common_items
+        ]
+        if not candidates:
+            return []
+        
+        # Candidate scores on the target's items, one row per candidate
+        item_columns = {product_id: col for col, product_id in enumerate(user_items)}
+        candidate_scores = np.zeros((len(candidates), len(item_columns)))
+        common_mask = np.zeros((len(candidates), len(item_columns)), dtype=bool)
+        for row, other_user_id in enumerate(candidates):
+            for product_id, score in user_common_scores[other_user_id].items():
+                col = item_columns[product_id]
+                candidate_scores[row, col] = score
+                common_mask[row, col] = True
+        
+        target_scores = np.fromiter(user_items.values(), dtype=np.float64, count=len(user_items))
+        similarities = self._cosine_on_common(candidate_scores, common_mask, target_scores)
+        
+        similar_users = [
+            (other_user_id, float(similarity))
+            for other_user_id, similarity in zip(candidates, similarities)
+            if similarity >= self.similarity_threshold
+        ]
+        
+        # Most similar users only
+        top = _top_k_indices([similarity for _, similarity in similar_users], self.top_k_neighbors)
+        return [similar_users[i] for i in top]
     
     def _calculate_user_similarity(self, items1, items2, common_items):
         """Calculate similarity between two users based on their interactions"""
@@ -355,28 +415,49 @@ class AdvancedNeighborsRecommender:
             score2 = items2.get(item, 0.0)
             
             numerator += score1 * score2
-            sum_sq1 += score1 ** 2
-            sum_sq2 += score2 ** 2
+            sum_sq1 += score1 * score1
+            sum_sq2 += score2 * score2
         
-        denominator = np.sqrt(sum_sq1) * np.sqrt(sum_sq2)
+        # Scalar math: numpy calls cost more than the work for a handful of items
+        denominator = math.sqrt(sum_sq1) * math.sqrt(sum_sq2)
         if denominator == 0:
             return 0.0
         
         return numerator / denominator
     
-    def _get_neighbor_recommendations(self, user_id, similar_users, candidate_products, limit):
-        """Get recommendations based on similar users' preferences"""
+    @staticmethod
+    def _cosine_on_common(candidate_scores, common_mask, target_scores):
+        """
+        Batched _calculate_user_similarity: cosine between the target and each
+        candidate row, restricted to the items flagged in that row's common_mask.
+        """
+        numerator = candidate_scores @ target_scores
+        sum_sq1 = common_mask @ (target_scores * target_scores)
+        sum_sq2 = np.einsum('ij,ij->i', candidate_scores, candidate_scores)
+        
+        denominator = np.sqrt(sum_sq1) * np.sqrt(sum_sq2)
+        similarities = np.zeros(len(candidate_scores))
+        np.divide(numerator, denominator, out=similarities, where=denominator != 0)
+        return similarities
+    
+    def _get_neighbor_recommendations(self, user_id, similar_users, candidate_products, limit, user_items=None):
+        """Get recommendations based on similar users' preferences, reusing the user's loaded items if given"""
         # Get user's existing items to exclude
-        user_items = set(self._get_user_item_interactions(user_id).keys())
+        if user_items is None:
+            user_items = self._get_user_item_interactions(user_id)
+        user_items = set(user_items)
         
         # Aggregate scores from similar users
         product_scores = defaultdict(float)
         product_neighbor_count = defaultdict(int)
         
         candidate_ids = {p.id for p in candidate_products}
+        neighbors_items = self._get_users_item_interactions(
+            [neighbor_id for neighbor_id, _ in similar_users]
+        )
         
         for neighbor_id, similarity in similar_users:
-            neighbor_items = self._get_user_item_interactions(neighbor_id)
+            neighbor_items = neighbors_items.get(neighbor_id, {})
             
             for product_id, score in neighbor_items.items():
                 if product_id not in user_items and product_id in candidate_ids:
@@ -389,12 +470,12 @@ class AdvancedNeighborsRecommender:
             if product_neighbor_count[product_id] > 0:
                 product_scores[product_id] /= product_neighbor_count[product_id]
         
-        # Get products and sort by score
+        # Get products and select the top scored
         scored_products = []
         for product in candidate_products:
             if product.id in product_scores:
                 product._neighbor_score = product_scores[product.id]
-                scored_products.append((product_scores[product.id], product))
+                scored_products.append(product)
         
-        scored_products.sort(key=lambda x: x[0], reverse=True)
-        return [product for _, product in scored_products[:limit]]
+        scores = [product._neighbor_score for product in scored_products]
+        return [scored_products[i] for i in _top_k_indices(scores, limit)]
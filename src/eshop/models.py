@@ -1,10 +1,16 @@
+import time
+from collections import defaultdict, namedtuple
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
 db = SQLAlchemy()
 
+# Detached category fields used for navigation links
+CategoryLink = namedtuple('CategoryLink', ['id', 'slug', 'name', 'product_count'])
+
 class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -57,17 +63,16 @@ class Category(db.Model):
         if not include_subcategories:
             return self.products.all()
         
-        # Collect all descendant category IDs
-        category_ids = [self.id]
-        to_process = list(self.children)
-        
-        while to_process:
-            child = to_process.pop(0)
-            category_ids.append(child.id)
-            to_process.extend(child.children)
-        
-        # Get all products from these categories
-        return Product.query.filter(Product.category_id.in_(category_ids)).all()
+        # Get all products from this category and its descendants
+        return Product.query.filter(Product.category_id.in_(self.get_subtree_ids())).all()
+    
+    def get_subtree_ids(self):
+        """Get IDs of this category and all its descendants in one recursive query"""
+        subtree = db.select(Category.id).where(Category.id == self.id).cte('subtree', recursive=True)
+        subtree = subtree.union_all(
+            db.select(Category.id).where(Category.parent_id == subtree.c.id)
+        )
+        return db.session.scalars(db.select(subtree.c.id)).all()
     
     def get_product_count(self, include_subcategories=False):
         """Get count of products in this category"""
@@ -75,10 +80,66 @@ class Category(db.Model):
             return self.products.count()
         return len(self.get_all_products(include_subcategories=True))
     
+    @classmethod
+    def get_product_counts(cls):
+        """
+        Count products per category with a single GROUP BY
+        
+        Returns:
+            Tuple of (direct_counts, subtree_counts) dicts keyed by category ID,
+            where subtree_counts include all subcategories
+        """
+        direct_counts = dict(
+            db.session.query(Product.category_id, db.func.count(Product.id))
+            .filter(Product.category_id.isnot(None))
+            .group_by(Product.category_id)
+            .all()
+        )
+        
+        # Roll each category's count up to all of its ancestors
+        parent_ids = dict(db.session.query(cls.id, cls.parent_id).all())
+        subtree_counts = defaultdict(int)
+        for category_id, count in direct_counts.items():
+            current = category_id
+            while current is not None:
+                subtree_counts[current] += count
+                current = parent_ids.get(current)
+        
+        return direct_counts, dict(subtree_counts)
+    
     @classmethod
     def get_main_categories(cls):
         """Get all main categories (no parent)"""
         return cls.query.filter_by(parent_id=None).order_by(cls.name).all()
+    
+    # Database URL -> (expires_at, [CategoryLink, ...]); product counts may
+    # lag behind by up to ttl seconds
+    _main_categories_cache = {}
+    
+    @classmethod
+    def get_main_categories_cached(cls, ttl=300):
+        """Get main categories as detached CategoryLinks, cached for ttl seconds"""
+        key = str(db.engine.url)
+        now = time.monotonic()
+        
+        cached = cls._main_categories_cache.get(key)
+        if cached is None or cached[0] <= now:
+            _, subtree_counts = cls.get_product_counts()
+            links = [
+                CategoryLink(c.id, c.slug, c.name, subtree_counts.get(c.id, 0))
+                for c in cls.get_main_categories()
+            ]
+            cached = (now + ttl, links)
+            cls._main_categories_cache[key] = cached
+        
+        return cached[1]
+
+@event.listens_for(Category, 'after_insert')
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _invalidate_main_categories(mapper, connection, target):
+    """Drop cached navigation categories when any category changes"""
+    Category._main_categories_cache.clear()
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -113,6 +174,10 @@ class Product(db.Model):
     order_items = db.relationship('OrderItem', backref='product', lazy='dynamic')
     interactions = db.relationship('UserInteraction', backref='product', lazy='dynamic')
     
+    __table_args__ = (
+        db.Index('idx_product_discount_stock', 'discount_percentage', 'stock_quantity'),
+    )
+    
     def get_tags_list(self):
         """Return tags as a list"""
         return [tag.strip() for tag in self.tags.split(',')] if self.tags else []
@@ -130,6 +195,10 @@ class Order(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     items = db.relationship('OrderItem', backref='order', lazy='dynamic')
+    
+    __table_args__ = (
+        db.Index('idx_order_user_created', 'user_id', 'created_at'),
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,6 +206,10 @@ class OrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Integer, default=1)
     price = db.Column(db.Float, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_order_item_order_product', 'order_id', 'product_id'),
+    )
 
 class UserInteraction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -144,6 +217,11 @@ class UserInteraction(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     interaction_type = db.Column(db.String(20), nullable=False)  # view, click, purchase
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        db.Index('idx_interaction_product_user', 'product_id', 'user_id', 'interaction_type'),
+        db.Index('idx_interaction_user_product', 'user_id', 'product_id', 'interaction_type'),
+    )
 
 class GuestInteraction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
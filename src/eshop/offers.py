@@ -87,11 +87,34 @@ class OfferGenerator:
         Returns:
             List of PersonalizedOffer objects with product relationship loaded
         """
-        return PersonalizedOffer.query.join(Product).filter(
+        # Populate offer.product from the existing join instead of joining again
+        return PersonalizedOffer.query.join(PersonalizedOffer.product).filter(
             PersonalizedOffer.user_id == user_id,
             PersonalizedOffer.is_used == False,
             PersonalizedOffer.expires_at > datetime.utcnow()
-        ).options(db.joinedload(PersonalizedOffer.product)).all()
+        ).options(db.contains_eager(PersonalizedOffer.product)).all()
+    
+    def get_active_offers_with_prices(self, user_id):
+        """
+        Get active offers for a user with the offer price math done in SQL
+        
+        Args:
+            user_id: The user ID
+            
+        Returns:
+            List of (offer, product, final_price, savings) rows
+        """
+        discount_fraction = PersonalizedOffer.discount_percentage / 100.0
+        return db.session.query(
+            PersonalizedOffer,
+            Product,
+            (Product.price * (1 - discount_fraction)).label('final_price'),
+            (Product.price * discount_fraction).label('savings')
+        ).join(Product, PersonalizedOffer.product_id == Product.id).filter(
+            PersonalizedOffer.user_id == user_id,
+            PersonalizedOffer.is_used == False,
+            PersonalizedOffer.expires_at > datetime.utcnow()
+        ).all()
     
     def get_active_offers(self, user_id):
         """
@@ -127,6 +150,36 @@ class OfferGenerator:
         
         return product.get_discounted_price(), None
     
+    def bulk_apply(self, products, user_id):
+        """
+        Apply active offers to several products with a single offer query
+        
+        Args:
+            products: List of Product objects
+            user_id: User ID
+            
+        Returns:
+            Dict mapping product ID to final price
+        """
+        offers = PersonalizedOffer.query.filter(
+            PersonalizedOffer.user_id == user_id,
+            PersonalizedOffer.product_id.in_([product.id for product in products]),
+            PersonalizedOffer.is_used == False,
+            PersonalizedOffer.expires_at > datetime.utcnow()
+        ).all()
+        offer_discounts = {offer.product_id: offer.discount_percentage for offer in offers}
+        
+        prices = {}
+        for product in products:
+            base_price = product.get_discounted_price()
+            offer_discount = offer_discounts.get(product.id)
+            if offer_discount is not None:
+                # Same stacking as apply_offer_to_product_price
+                base_price -= base_price * (offer_discount / 100)
+            prices[product.id] = base_price
+        
+        return prices
+    
     def cleanup_expired_offers(self):
         """Remove expired offers from the database"""
         expired_offers = PersonalizedOffer.query.filter(
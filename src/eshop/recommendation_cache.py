@@ -288,8 +288,8 @@ class CacheManager:
         warmed_count = 0
         for user_id in user_ids:
             try:
-                # Generate recommendations (will be cached)
-                recommendations = recommender.get_recommendations(user_id, limit=10)
+                # Generate recommendations through the cached path
+                recommendations = recommender.get_cached_recommendations(user_id, limit=10)
                 if recommendations:
                     warmed_count += 1
             except Exception as e:
@@ -138,7 +138,9 @@ class Recommender:
     def _cold_start_for_guest(session_id, limit=5):
         """Cold start recommendations based on guest session activity with conversion optimization"""
         # Get guest's interaction history
-        interactions = GuestInteraction.query.filter_by(session_id=session_id).all()
+        interactions = GuestInteraction.query.filter_by(session_id=session_id).options(
+            db.joinedload(GuestInteraction.product)
+        ).all()
         
         if not interactions:
             return []
@@ -256,7 +258,9 @@ class Recommender:
     def get_cold_start_recommendations(user_id, limit=4):
         """Get recommendations for users with minimal data using cold start algorithm with conversion optimization"""
         # Get user interactions
-        interactions = UserInteraction.query.filter_by(user_id=user_id).all()
+        interactions = UserInteraction.query.filter_by(user_id=user_id).options(
+            db.joinedload(UserInteraction.product)
+        ).all()
         
         if not interactions:
             return []
@@ -0,0 +1,29 @@
+from sqlalchemy import insert
+from .models import db, Product
+
+
+def seed_sample_products():
+    """Insert a few sample products if the database has none"""
+    # EXISTS stops at the first row instead of counting the whole table
+    if db.session.query(Product.query.exists()).scalar():
+        return 0
+    
+    sample_products = [
+        dict(name='Premium Noise-Cancelling Wireless Headphones', price=129.99,
+             category='Electronics', image='placeholder.jpg',
+             description='Noise-cancelling wireless headphones with premium sound quality.'),
+        dict(name='Smart Fitness Watch', price=89.99,
+             category='Electronics', image='placeholder.jpg',
+             description='Track your fitness goals with this advanced smart watch.'),
+        dict(name='Ultra-Portable Power Bank', price=49.99,
+             category='Electronics', image='placeholder.jpg',
+             description='20,000mAh power bank for all your charging needs.'),
+        dict(name='Waterproof Bluetooth Speaker', price=79.99,
+             category='Electronics', image='placeholder.jpg',
+             description='Waterproof speaker with 360° sound.')
+    ]
+    # Core executemany skips building ORM instances for rows we never read back
+    db.session.execute(insert(Product), sample_products)
+    db.session.commit()
+    
+    return len(sample_products)
@@ -2,6 +2,7 @@ import uuid
 from flask import session
 from datetime import datetime, timezone
 from .models import db, GuestInteraction, Cart, UserInteraction
+from .tracking_queue import enqueue_guest_interaction
 
 class SessionManager:
     """Manages guest sessions and transitions to authenticated users"""
@@ -30,6 +31,12 @@ class SessionManager:
         
         return interaction
     
+    @staticmethod
+    def queue_guest_interaction(product_id, interaction_type):
+        """Queue a guest interaction for the background batch writer"""
+        session_id = SessionManager.get_or_create_session_id()
+        enqueue_guest_interaction(session_id, product_id, interaction_type)
+    
     @staticmethod
     def get_or_create_cart(user=None):
         """Get or create cart for current session/user"""
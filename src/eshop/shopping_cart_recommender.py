@@ -1,8 +1,39 @@
+import threading
 import numpy as np
-from collections import defaultdict
-from datetime import datetime
-from .models import db, Order, OrderItem
-from sqlalchemy import func
+from collections import defaultdict, namedtuple
+from itertools import groupby
+from operator import itemgetter
+from scipy import sparse
+from .models import db, Order, OrderItem, Product
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+
+
+def _top_k_indices(scores, limit):
+    """
+    Return indices of the `limit` highest scores, best first.
+    
+    Selects with a partition instead of sorting every candidate. Ties keep
+    their input order, so the result matches a stable sort(reverse=True).
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if limit <= 0:
+        return np.array([], dtype=np.intp)
+    
+    if len(scores) > limit:
+        # Value of the limit-th highest score; ties at it are taken in input order
+        kth = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:limit - len(above)]
+        top = np.sort(np.concatenate([above, tied]))
+    else:
+        top = np.arange(len(scores))
+    
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+# A recommended product paired with the score that ranked it
+Scored = namedtuple('Scored', ['product', 'score'])
 
 
 class ShoppingCartRecommender:
@@ -15,16 +46,37 @@ class ShoppingCartRecommender:
         self.min_support = min_support
         self.min_confidence = min_confidence
         
-    def get_recommendations_for_cart(self, cart_product_ids, limit=10):
+    def get_recommendations_for_cart(self, cart_product_ids, limit=10, with_scores=False):
         """
         Simplified interface for getting cart recommendations
         Gets all products as candidates automatically
         """
-        from .models import Product
-        candidate_products = Product.query.all()
-        return self.get_cart_recommendations(cart_product_ids, candidate_products, limit)
+        if not cart_product_ids:
+            return []
+        
+        # Score against lightweight (id, category) rows instead of ORM objects
+        candidates = self._get_candidate_rows()
+        product_scores = self._score_cart_candidates(cart_product_ids, candidates)
+        top = self._select_top_k(product_scores, candidates, limit)
+        
+        # Load full products only for the top-k
+        top_ids = [row.id for row in top]
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(top_ids)).all()}
+        
+        recommendations = [products[pid] for pid in top_ids if pid in products]
+        return self._attach_scores(recommendations, product_scores, with_scores)
+    
+    def _get_candidate_rows(self):
+        """Get (id, category) rows for all products, rebuilt only after products change"""
+        return _get_cached(_product_cache, self._load_candidate_rows)
+    
+    def _load_candidate_rows(self):
+        """Load (id, category) rows for all products"""
+        # Order by id so ties rank the same as Product.query.all()
+        return db.session.query(Product.id, Product.category).order_by(Product.id).all()
         
-    def get_cart_recommendations(self, cart_product_ids, candidate_products, limit=10, diversify=False):
+    def get_cart_recommendations(self, cart_product_ids, candidate_products, limit=10, diversify=False,
+                                 with_scores=False):
         """
         Get product recommendations based on current cart contents
         
@@ -33,6 +85,7 @@ class ShoppingCartRecommender:
             candidate_products: List of products to recommend from
             limit: Number of recommendations
             diversify: Whether to ensure category diversity
+            with_scores: Return Scored(product, score) pairs instead of products
             
         Returns:
             List of recommended products
@@ -40,163 +93,206 @@ class ShoppingCartRecommender:
         if not cart_product_ids:
             return []
         
-        # Get association data
-        associations, product_counts, total_orders = self._get_association_data()
-        
-        # Score each candidate product
-        product_scores = {}
-        
-        for product in candidate_products:
-            if product.id in cart_product_ids:
-                continue  # Skip products already in cart
-                
-            # Calculate association score with all cart items
-            total_score = 0.0
-            for cart_item_id in cart_product_ids:
-                score = self._calculate_association_score(
-                    cart_item_id, 
-                    product.id,
-                    associations,
-                    product_counts,
-                    total_orders
-                )
-                total_score += score
-            
-            if total_score > 0:
-                product_scores[product.id] = total_score
-                product._cart_association_score = total_score
-        
-        # Sort products by score
-        scored_products = []
-        for product in candidate_products:
-            if product.id in product_scores:
-                scored_products.append((product_scores[product.id], product))
-        
-        scored_products.sort(key=lambda x: x[0], reverse=True)
+        product_scores = self._score_cart_candidates(cart_product_ids, candidate_products)
         
         if diversify:
-            return self._diversify_recommendations([p for _, p in scored_products], limit)
+            # Diversification may reach past the top-k, so rank everything
+            ranked = self._select_top_k(product_scores, candidate_products, len(product_scores))
+            recommendations = self._diversify_recommendations(ranked, limit)
         else:
-            return [product for _, product in scored_products[:limit]]
+            recommendations = self._select_top_k(product_scores, candidate_products, limit)
+        
+        return self._attach_scores(recommendations, product_scores, with_scores)
     
-    def get_complementary_products(self, product_id, candidate_products, limit=5):
+    def _score_cart_candidates(self, cart_product_ids, candidate_products):
+        """Map candidate id -> summed association score with the cart items"""
+        cart_set = set(cart_product_ids)
+        
+        # Get association data
+        associations, product_counts, product_index, total_orders = self._get_association_data()
+        
+        # Only products bought together with a cart item can score above 0,
+        # so restrict scoring to the non-zero columns of the cart's rows
+        cart_idx = [product_index[pid] for pid in cart_set if pid in product_index]
+        if not cart_idx:
+            return {}
+        co_occurring = set(associations[cart_idx].indices.tolist())
+        
+        # Skip products already in cart
+        candidate_ids = [
+            p.id for p in candidate_products
+            if p.id not in cart_set and product_index.get(p.id, -1) in co_occurring
+        ]
+        
+        # Score every candidate against all cart items in one pass
+        scores = self._association_score_matrix(
+            cart_product_ids,
+            candidate_ids,
+            associations,
+            product_counts,
+            product_index,
+            total_orders
+        ).sum(axis=0)
+        
+        return {
+            product_id: total_score
+            for product_id, total_score in zip(candidate_ids, scores.tolist())
+            if total_score > 0
+        }
+    
+    def get_complementary_products(self, product_id, candidate_products, limit=5, with_scores=False):
         """
         Get products that are frequently bought with a specific product
         """
-        associations, product_counts, total_orders = self._get_association_data()
-        
-        scored_products = []
-        for product in candidate_products:
-            if product.id == product_id:
-                continue
-                
-            score = self._calculate_association_score(
-                product_id,
-                product.id,
-                associations,
-                product_counts,
-                total_orders
-            )
-            
-            if score > 0:
-                product._complementary_score = score
-                scored_products.append((score, product))
-        
-        scored_products.sort(key=lambda x: x[0], reverse=True)
-        return [product for _, product in scored_products[:limit]]
+        associations, product_counts, product_index, total_orders = self._get_association_data()
+        
+        candidates = [p for p in candidate_products if p.id != product_id]
+        scores = self._association_score_matrix(
+            [product_id],
+            [p.id for p in candidates],
+            associations,
+            product_counts,
+            product_index,
+            total_orders
+        )[0]
+        
+        product_scores = {
+            product.id: score
+            for product, score in zip(candidates, scores.tolist())
+            if score > 0
+        }
+        
+        recommendations = self._select_top_k(product_scores, candidate_products, limit)
+        return self._attach_scores(recommendations, product_scores, with_scores)
     
-    def get_abandoned_cart_recovery(self, user_id, abandoned_items, candidate_products, limit=5):
+    def get_abandoned_cart_recovery(self, user_id, abandoned_items, candidate_products, limit=5,
+                                    with_scores=False):
         """
         Get recommendations to recover abandoned cart based on user history
         """
+        abandoned_set = set(abandoned_items)
+        
         # Get user's purchase history
         purchase_history = self._get_user_purchase_history(user_id)
+        purchased = set(purchase_history)
         
         # Get associations
-        associations, product_counts, total_orders = self._get_association_data()
+        associations, product_counts, product_index, total_orders = self._get_association_data()
         
         # Score products based on association with both history and abandoned items
-        product_scores = {}
-        
-        for product in candidate_products:
-            if product.id in abandoned_items or product.id in purchase_history:
-                continue
-                
-            score = 0.0
-            
-            # Score based on abandoned items
-            for item_id in abandoned_items:
-                score += self._calculate_association_score(
-                    item_id, product.id, associations, product_counts, total_orders
-                ) * 1.5  # Weight abandoned items more
-            
-            # Score based on purchase history
-            for item_id in purchase_history[-5:]:  # Last 5 purchases
-                score += self._calculate_association_score(
-                    item_id, product.id, associations, product_counts, total_orders
-                )
-            
-            if score > 0:
-                product_scores[product.id] = score
-                product._recovery_score = score
+        candidates = [p for p in candidate_products
+                      if p.id not in abandoned_set and p.id not in purchased]
+        candidate_ids = [p.id for p in candidates]
+        
+        # Score based on abandoned items, weighted more than history
+        scores = self._association_score_matrix(
+            abandoned_items, candidate_ids, associations, product_counts, product_index, total_orders
+        ).sum(axis=0) * 1.5
+        
+        # Score based on the 5 most recent purchases
+        scores += self._association_score_matrix(
+            purchase_history[:5], candidate_ids, associations, product_counts, product_index, total_orders
+        ).sum(axis=0)
+        
+        product_scores = {
+            product.id: score
+            for product, score in zip(candidates, scores.tolist())
+            if score > 0
+        }
+        
+        recommendations = self._select_top_k(product_scores, candidate_products, limit)
+        return self._attach_scores(recommendations, product_scores, with_scores)
+    
+    def _attach_scores(self, recommendations, product_scores, with_scores):
+        """Wrap the final recommendations as Scored pairs when requested"""
+        if not with_scores:
+            return recommendations
+        return [Scored(product, product_scores[product.id]) for product in recommendations]
+    
+    def _select_top_k(self, product_scores, candidate_products, limit):
+        """
+        Return the `limit` highest scoring candidates, best first.
         
-        # Sort and return
-        scored_products = [(score, p) for p in candidate_products 
-                          if p.id in product_scores]
-        scored_products.sort(key=lambda x: x[0], reverse=True)
+        Works on product_scores directly, whose insertion order follows
+        candidate_products, so ties keep candidate order.
+        """
+        if not product_scores:
+            return []
         
-        return [product for _, product in scored_products[:limit]]
+        scored_ids = list(product_scores)
+        id_to_product = {p.id: p for p in candidate_products}
+        return [id_to_product[scored_ids[i]]
+                for i in _top_k_indices(list(product_scores.values()), limit)]
     
     def _get_association_data(self):
-        """Get product association data from order history"""
-        # Get all orders with their items
-        orders_data = []
-        orders = db.session.query(Order).all()
-        
-        for order in orders:
-            items = db.session.query(OrderItem.product_id).filter_by(order_id=order.id).all()
-            if items:
-                products = [item[0] for item in items]
-                orders_data.append((order.id, products))
-        
-        # Build association matrix
-        associations = self._build_association_matrix(orders_data)
-        
-        # Count product occurrences
-        product_counts = defaultdict(int)
-        for _, products in orders_data:
-            for product_id in products:
-                product_counts[product_id] += 1
+        """Get product association data, rebuilt only after orders change"""
+        return get_cached_assoc()
+    
+    def _load_association_data(self):
+        """Load product association data from order history"""
+        # Fetch every order's items in one query and group them by order
+        rows = db.session.query(
+            OrderItem.order_id,
+            OrderItem.product_id
+        ).order_by(OrderItem.order_id).all()
+        
+        orders_data = [
+            (order_id, [product_id for _, product_id in items])
+            for order_id, items in groupby(rows, key=itemgetter(0))
+        ]
+        
+        # Count product occurrences in a dense array addressed through product_index
+        product_ids = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+        unique_ids = np.unique(product_ids)
+        product_index = {int(product_id): i for i, product_id in enumerate(unique_ids)}
+        
+        product_counts = np.zeros(len(unique_ids), dtype=np.int32)
+        np.add.at(product_counts, np.searchsorted(unique_ids, product_ids), 1)
+        
+        # Build association matrix over the same index
+        associations = self._build_association_matrix(orders_data, product_index)
         
         total_orders = len(orders_data)
         
-        return associations, dict(product_counts), total_orders
+        return associations, product_counts, product_index, total_orders
     
-    def _build_association_matrix(self, orders_data):
-        """Build co-occurrence matrix from order data"""
-        associations = defaultdict(int)
+    def _build_association_matrix(self, orders_data, product_index):
+        """
+        Build sparse co-occurrence matrix from order data.
         
-        for order_id, products in orders_data:
-            # Count co-occurrences for all product pairs in the order
-            for i, product1 in enumerate(products):
-                for product2 in products[i+1:]:
-                    if product1 != product2:
-                        associations[(product1, product2)] += 1
-                        associations[(product2, product1)] += 1
+        Rows and columns are addressed through product_index. The matrix is
+        computed as T.T @ T over the order x product incidence matrix T, with
+        the diagonal (a product paired with itself) cleared.
+        """
+        order_rows = []
+        product_cols = []
+        for row, (order_id, products) in enumerate(orders_data):
+            for product_id in products:
+                order_rows.append(row)
+                product_cols.append(product_index[product_id])
         
-        return dict(associations)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(order_rows), dtype=np.int32), (order_rows, product_cols)),
+            shape=(len(orders_data), len(product_index))
+        )
+        
+        associations = (incidence.T @ incidence).tocsr()
+        associations.setdiag(0)
+        associations.eliminate_zeros()
+        
+        return associations
     
     def _build_association_matrix_with_time_decay(self, orders_with_time):
         """Build association matrix with time decay for recency"""
         associations = defaultdict(float)
         
-        current_time = datetime.utcnow()
+        # Calculate time decay factors for all orders in one pass
+        order_dates = np.array([order_date for _, _, order_date in orders_with_time],
+                               dtype='datetime64[D]')
+        days_old = (np.datetime64('today') - order_dates).astype('timedelta64[D]').astype(float)
+        decay = (1.0 / (1.0 + days_old / 30.0)).tolist()  # 30-day half-life
         
-        for order_id, products, order_date in orders_with_time:
-            # Calculate time decay factor
-            days_old = (current_time - order_date).days
-            decay_factor = 1.0 / (1.0 + days_old / 30.0)  # 30-day half-life
-            
+        for (order_id, products, order_date), decay_factor in zip(orders_with_time, decay):
             # Count co-occurrences with decay
             for i, product1 in enumerate(products):
                 for product2 in products[i+1:]:
@@ -207,57 +303,171 @@ class ShoppingCartRecommender:
         return dict(associations)
     
     def _calculate_association_score(self, product1_id, product2_id, 
-                                   associations, product_counts, total_orders):
-        """Calculate association score using confidence and lift metrics"""
-        # Get co-occurrence count
-        co_occurrence = associations.get((product1_id, product2_id), 0)
-        
-        if co_occurrence < self.min_support:
-            return 0.0
+                                   associations, product_counts, product_index, total_orders):
+        """Calculate association score for a single product pair"""
+        return float(self._association_score_matrix(
+            [product1_id], [product2_id], associations, product_counts, product_index, total_orders
+        )[0, 0])
+    
+    def _association_score_matrix(self, source_ids, target_ids,
+                                  associations, product_counts, product_index, total_orders):
+        """
+        Score every (source, target) product pair at once.
         
-        # Calculate confidence: P(product2 | product1)
-        product1_count = product_counts.get(product1_id, 1)
-        confidence = co_occurrence / product1_count
+        Returns a len(source_ids) x len(target_ids) array. Products missing
+        from product_index have never been ordered and score 0.
+        """
+        source_idx = np.array([product_index.get(pid, -1) for pid in source_ids], dtype=np.int64)
+        target_idx = np.array([product_index.get(pid, -1) for pid in target_ids], dtype=np.int64)
+        known_source = source_idx >= 0
+        known_target = target_idx >= 0
+        
+        co_occurrence = np.zeros((len(source_idx), len(target_idx)), dtype=np.float32)
+        if known_source.any() and known_target.any():
+            block = associations[source_idx[known_source]][:, target_idx[known_target]]
+            co_occurrence[np.ix_(known_source, known_target)] = block.toarray()
+        
+        source_counts = np.ones(len(source_idx), dtype=np.float32)
+        source_counts[known_source] = product_counts[source_idx[known_source]]
+        target_counts = np.ones(len(target_idx), dtype=np.float32)
+        target_counts[known_target] = product_counts[target_idx[known_target]]
+        
+        return self._association_scores(co_occurrence, source_counts, target_counts, total_orders)
+    
+    def _association_scores(self, co_occurrence, source_counts, target_counts, total_orders):
+        """
+        Calculate association scores using confidence and lift metrics.
         
-        if confidence < self.min_confidence:
-            return 0.0
+        Vectorized over a co-occurrence block: pairs below min_support or
+        min_confidence are masked to 0 instead of branched on. Inputs are
+        float32; the precision is ample for ranking.
+        """
+        # Calculate confidence: P(target | source)
+        confidence = co_occurrence / np.maximum(source_counts[:, None], 1)
         
-        # Calculate lift: confidence / P(product2)
-        product2_count = product_counts.get(product2_id, 1)
-        product2_probability = product2_count / max(total_orders, 1)
-        lift = confidence / max(product2_probability, 0.001)
+        # Calculate lift: confidence / P(target)
+        target_probability = target_counts[None, :] / max(total_orders, 1)
+        lift = confidence / np.maximum(target_probability, 0.001)
         
         # Combine metrics
-        score = confidence * lift * np.log(1 + co_occurrence)
+        score = confidence * lift * np.log1p(co_occurrence)
         
-        return score
+        valid = (co_occurrence >= self.min_support) & (confidence >= self.min_confidence)
+        return np.where(valid, score, 0.0)
     
     def _get_user_purchase_history(self, user_id):
-        """Get list of products user has purchased"""
+        """Get list of products user has purchased, most recent first"""
         purchases = db.session.query(OrderItem.product_id).join(Order).filter(
             Order.user_id == user_id
-        ).order_by(Order.created_at.desc()).all()
+        ).group_by(
+            OrderItem.product_id
+        ).order_by(
+            func.max(Order.created_at).desc(),
+            OrderItem.product_id
+        ).all()
         
         return [p[0] for p in purchases]
     
     def _diversify_recommendations(self, products, limit):
         """Ensure category diversity in recommendations"""
         diversified = []
+        remaining = []
         categories_seen = set()
         
-        # First pass: add top product from each category
+        # Single pass: top product from each category first, the rest kept in order
         for product in products:
-            if product.category not in categories_seen and len(diversified) < limit:
+            if product.category in categories_seen:
+                remaining.append(product)
+            else:
                 diversified.append(product)
                 categories_seen.add(product.category)
+                if len(diversified) >= limit:
+                    break
         
-        # Second pass: fill remaining slots
-        for product in products:
-            if product not in diversified and len(diversified) < limit:
-                diversified.append(product)
+        # Fill remaining slots
+        diversified.extend(remaining[:limit - len(diversified)])
         
         return diversified
     
     def _filter_associations_by_support(self, associations):
         """Filter associations by minimum support threshold"""
-        return {k: v for k, v in associations.items() if v >= self.min_support}
\ No newline at end of file
+        return {k: v for k, v in associations.items() if v >= self.min_support}
+
+
+# Association data and candidate product rows per database, shared by all
+# recommenders. Both are read far more often than written, so they are only
+# rebuilt after a commit has written to the tables they come from.
+_assoc_cache = {}
+_product_cache = {}
+_cache_lock = threading.Lock()
+
+# Cache derived from each watched table, cleared by commits that write to it
+_caches_by_table = {
+    Order.__table__.name: _assoc_cache,
+    OrderItem.__table__.name: _assoc_cache,
+    Product.__table__.name: _product_cache
+}
+
+# session.info key holding the watched tables the open transaction has written
+_CHANGED_TABLES = 'shopping_cart_changed_tables'
+
+
+def get_cached_assoc():
+    """
+    Get (associations, product_counts, product_index, total_orders) for the
+    current database, rebuilding it only when order data has changed.
+    """
+    return _get_cached(_assoc_cache, ShoppingCartRecommender()._load_association_data)
+
+
+def _get_cached(cache, load):
+    """Get the current database's entry from cache, loading it when missing"""
+    # Data read through uncommitted writes must not be shared with other sessions
+    if db.session.info.get(_CHANGED_TABLES):
+        return load()
+    
+    key = str(db.engine.url)
+    with _cache_lock:
+        if key not in cache:
+            cache[key] = load()
+        return cache[key]
+
+
+def _record_writes(session, table_names):
+    """Remember which watched tables the session's transaction has written"""
+    watched = _caches_by_table.keys() & table_names
+    if watched:
+        session.info.setdefault(_CHANGED_TABLES, set()).update(watched)
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_writes(session, flush_context):
+    """Record ORM inserts, updates and deletes"""
+    _record_writes(session, {
+        obj.__table__.name for obj in (*session.new, *session.dirty, *session.deleted)
+    })
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed_writes(orm_execute_state):
+    """Record Core and bulk DML run through the session, which skips mapper events"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _record_writes(orm_execute_state.session, {orm_execute_state.statement.table.name})
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_writes(session):
+    """Drop cached data derived from the tables the commit wrote to"""
+    changed = session.info.pop(_CHANGED_TABLES, ())
+    if changed:
+        with _cache_lock:
+            for table_name in changed:
+                _caches_by_table[table_name].clear()
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_uncommitted_writes(session, transaction):
+    """Forget writes of a transaction that ended without committing"""
+    # Savepoints ending inside the transaction leave its earlier writes pending
+    if transaction.parent is None:
+        session.info.pop(_CHANGED_TABLES, None)
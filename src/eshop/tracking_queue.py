@@ -0,0 +1,127 @@
+"""
+Background writer for product interaction tracking
+Batches interaction rows from request handlers into bulk INSERTs
+"""
+
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from flask import current_app
+from .models import db, UserInteraction, GuestInteraction
+from .recommendation_cache import CacheManager
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 100
+FLUSH_INTERVAL = 0.1  # seconds
+
+_start_lock = threading.Lock()
+
+
+def enqueue_user_interaction(user_id, product_id, interaction_type):
+    """Queue an interaction for an authenticated user"""
+    _enqueue(UserInteraction, {
+        'user_id': user_id,
+        'product_id': product_id,
+        'interaction_type': interaction_type,
+        'timestamp': datetime.utcnow()
+    })
+
+
+def enqueue_guest_interaction(session_id, product_id, interaction_type):
+    """Queue an interaction for a guest session"""
+    _enqueue(GuestInteraction, {
+        'session_id': session_id,
+        'product_id': product_id,
+        'interaction_type': interaction_type,
+        'timestamp': datetime.utcnow()
+    })
+
+
+def _enqueue(model, mapping):
+    """Hand a row to the writer thread, or write it immediately when SYNC_TRACK is set"""
+    app = current_app._get_current_object()
+    if app.config.get('SYNC_TRACK'):
+        _write_batch(app, [(model, mapping)])
+    else:
+        _get_queue().put((model, mapping))
+
+
+def _get_queue():
+    """Get the current app's tracking queue, starting its writer on first use"""
+    app = current_app._get_current_object()
+    
+    with _start_lock:
+        tracking_queue = app.extensions.get('tracking_queue')
+        if tracking_queue is None:
+            tracking_queue = queue.SimpleQueue()
+            app.extensions['tracking_queue'] = tracking_queue
+            
+            worker = threading.Thread(
+                target=_run_worker,
+                args=(app, tracking_queue),
+                name='tracking-queue-writer',
+                daemon=True
+            )
+            worker.start()
+            
+            # Write whatever is still queued when the process exits
+            atexit.register(_drain, app, tracking_queue)
+    
+    return tracking_queue
+
+
+def _run_worker(app, tracking_queue):
+    """Write queued interactions in batches of up to BATCH_SIZE rows"""
+    while True:
+        batch = [tracking_queue.get()]
+        deadline = time.monotonic() + FLUSH_INTERVAL
+        
+        while len(batch) < BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(tracking_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        
+        _write_batch(app, batch)
+
+
+def _drain(app, tracking_queue):
+    """Synchronously write everything left in the queue"""
+    batch = []
+    while True:
+        try:
+            batch.append(tracking_queue.get_nowait())
+        except queue.Empty:
+            break
+    
+    if batch:
+        _write_batch(app, batch)
+
+
+def _write_batch(app, batch):
+    """Insert a batch of (model, mapping) items with one commit"""
+    rows_by_model = defaultdict(list)
+    for model, mapping in batch:
+        rows_by_model[model].append(mapping)
+    
+    with app.app_context():
+        try:
+            for model, rows in rows_by_model.items():
+                db.session.bulk_insert_mappings(model, rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception("Dropped %d tracked interactions after a failed write", len(batch))
+            return
+        
+        # Cached recommendations for these users no longer reflect their history
+        for user_id in {row['user_id'] for row in rows_by_model.get(UserInteraction, ())}:
+            CacheManager.invalidate_user_cache(user_id)
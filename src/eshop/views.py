@@ -1,33 +1,95 @@
-from flask import Blueprint, render_template, send_from_directory, jsonify, request, current_app
-from flask_login import current_user, login_required
+from flask import Blueprint, render_template, send_from_directory, jsonify, request, current_app, session
+from flask_login import current_user
+from werkzeug.exceptions import NotFound
 from .models import db, Product, UserInteraction, GuestInteraction, BestSeller, TrendingProduct, Category
 from .recommender import Recommender
 from .session_manager import SessionManager
-from .offers import OfferGenerator
+from .tracking_queue import enqueue_user_interaction
+from .recommendation_cache import get_cache
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session, load_only
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 main = Blueprint('main', __name__)
 
+HOME_PAGE_TTL = 60  # seconds
+
+
+def _guest_home_cache_key():
+    """
+    Cache key for a guest's rendered homepage, or None when the page has
+    per-guest content and has to be rendered fresh
+    """
+    # Flashed messages belong to a single visitor
+    if '_flashes' in session:
+        return None
+    
+    # Until a guest interacts, everyone gets the same cold-start recommendations
+    session_id = session.get('session_id')
+    if session_id is not None and db.session.query(
+        GuestInteraction.query.filter_by(session_id=session_id).exists()
+    ).scalar():
+        return None
+    
+    return 'home_page:guest'
+
+
+# Tables whose rows appear on the cached guest homepage
+_HOME_PAGE_TABLES = {Product.__table__.name, Category.__table__.name}
+
+# session.info key set once the open transaction has written a homepage table
+_HOME_PAGE_CHANGED = 'home_page_changed'
+
+
+def _record_home_page_writes(session, table_names):
+    """Remember that the session's transaction wrote rows the homepage shows"""
+    if _HOME_PAGE_TABLES & table_names:
+        session.info[_HOME_PAGE_CHANGED] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_home_page_writes(session, flush_context):
+    """Record ORM inserts, updates and deletes"""
+    _record_home_page_writes(session, {
+        obj.__table__.name for obj in (*session.new, *session.dirty, *session.deleted)
+    })
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed_home_page_writes(orm_execute_state):
+    """Record Core and bulk DML run through the session, which skips mapper events"""
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _record_home_page_writes(orm_execute_state.session, {orm_execute_state.statement.table.name})
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_home_pages(session):
+    """Drop cached guest homepages once a commit changes the products or categories they show"""
+    if session.info.pop(_HOME_PAGE_CHANGED, False):
+        get_cache().invalidate('home_page:')
+
+
+@event.listens_for(Session, 'after_transaction_end')
+def _discard_uncommitted_home_page_writes(session, transaction):
+    """Forget writes of a transaction that ended without committing"""
+    # Savepoints ending inside the transaction leave its earlier writes pending
+    if transaction.parent is None:
+        session.info.pop(_HOME_PAGE_CHANGED, None)
+
+
 @main.route('/')
 def home():
-    # Initialize sample products if database is empty
-    if Product.query.count() == 0:
-        sample_products = [
-            Product(name='Premium Noise-Cancelling Wireless Headphones', price=129.99, 
-                   category='Electronics', image='placeholder.jpg',
-                   description='Noise-cancelling wireless headphones with premium sound quality.'),
-            Product(name='Smart Fitness Watch', price=89.99,
-                   category='Electronics', image='placeholder.jpg',
-                   description='Track your fitness goals with this advanced smart watch.'),
-            Product(name='Ultra-Portable Power Bank', price=49.99,
-                   category='Electronics', image='placeholder.jpg',
-                   description='20,000mAh power bank for all your charging needs.'),
-            Product(name='Waterproof Bluetooth Speaker', price=79.99,
-                   category='Electronics', image='placeholder.jpg',
-                   description='Waterproof speaker with 360° sound.')
-        ]
-        db.session.add_all(sample_products)
-        db.session.commit()
+    # Guest pages carry no per-user offers, so the rendered HTML can be reused briefly
+    cache_key = None
+    if not current_user.is_authenticated:
+        cache_key = _guest_home_cache_key()
+        if cache_key is not None:
+            cached_page = get_cache().get(cache_key)
+            if cached_page is not None:
+                return cached_page
     
     # Get personalized recommendations
     personalized_offers = []
@@ -37,41 +99,40 @@ def home():
         recommended_products = Recommender.get_recommendations_for_user(current_user.id, limit=8)
         
         # Get or generate personalized offers
-        offer_generator = OfferGenerator()
+        offer_generator = current_app.extensions['offer_generator']
         active_offers = offer_generator.refresh_user_offers(current_user.id, num_offers=4)
         
-        # Create a set of product IDs with active offers
-        offer_product_ids = {offer.product_id for offer in active_offers}
+        # Map product IDs to their active offers
+        offers_by_product_id = {offer.product_id: offer for offer in active_offers}
+        final_prices = offer_generator.bulk_apply(recommended_products, current_user.id)
         
         # Prioritize products with offers in recommendations
         products_with_offers = []
         products_without_offers = []
         
         for product in recommended_products:
-            if product.id in offer_product_ids:
-                # Find the corresponding offer
-                offer = next((o for o in active_offers if o.product_id == product.id), None)
-                if offer:
-                    products_with_offers.append({
-                        'product': product,
-                        'has_offer': True,
-                        'offer': offer,
-                        'final_price': offer_generator.apply_offer_to_product_price(product, current_user.id)[0]
-                    })
+            offer = offers_by_product_id.get(product.id)
+            if offer is not None:
+                products_with_offers.append({
+                    'product': product,
+                    'has_offer': True,
+                    'offer': offer,
+                    'final_price': final_prices[product.id]
+                })
             else:
                 products_without_offers.append({
                     'product': product,
                     'has_offer': False,
                     'offer': None,
-                    'final_price': product.get_discounted_price()
+                    'final_price': final_prices[product.id]
                 })
         
         # Combine offers first, then other recommendations
         personalized_offers = (products_with_offers + products_without_offers)[:4]
         
     else:
-        # Get session ID for guest recommendations
-        session_id = SessionManager.get_or_create_session_id()
+        # Guests get a session ID on their first interaction; reading the page needs none
+        session_id = session.get('session_id')
         recommended_products = Recommender.get_recommendations_for_guest(session_id, limit=4)
         
         # For guests, no personalized offers
@@ -86,74 +147,92 @@ def home():
         ]
     
     # Log recommendation count for debugging
-    print(f"[DEBUG] Returning {len(personalized_offers)} recommendations for {'user' if current_user.is_authenticated else 'guest'}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Returning %d recommendations for %s", len(personalized_offers),
+                     'user' if current_user.is_authenticated else 'guest')
     
     # Get main categories for navigation
-    main_categories = Category.get_main_categories()
+    main_categories = Category.get_main_categories_cached()
     
-    return render_template('index.html', 
+    page = render_template('index.html', 
                          personalized_offers=personalized_offers,
                          main_categories=main_categories)
+    
+    if cache_key is not None:
+        get_cache().set(cache_key, page, ttl=HOME_PAGE_TTL)
+    
+    return page
+
+# Product images rarely change, so let browsers cache them for a day
+IMAGE_MAX_AGE = 86400
 
 @main.route('/static/images/<path:filename>')
 def serve_placeholder(filename):
-    # For simplicity, serve a placeholder for all image requests
-    return send_from_directory(os.path.join(current_app.root_path, 'static'), 'style.css')
+    images_dir = os.path.join(current_app.root_path, 'static', 'images')
+    try:
+        return send_from_directory(images_dir, filename, max_age=IMAGE_MAX_AGE)
+    except NotFound:
+        # Fall back to the placeholder for images that don't exist yet
+        return send_from_directory(images_dir, 'placeholder.jpg', max_age=IMAGE_MAX_AGE)
+
+TRACKED_INTERACTION_TYPES = {'view', 'click', 'add_to_cart', 'purchase'}
 
 @main.route('/track', methods=['POST'])
 def track_interaction():
     """Track user/guest interactions with products"""
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     product_id = data.get('product_id')
     interaction_type = data.get('type', 'view')
     
-    if product_id:
-        if current_user.is_authenticated:
-            # Track for authenticated user
-            interaction = UserInteraction(
-                user_id=current_user.id,
-                product_id=product_id,
-                interaction_type=interaction_type
-            )
-            db.session.add(interaction)
-            db.session.commit()
-        else:
-            # Track for guest user
-            SessionManager.track_guest_interaction(product_id, interaction_type)
+    # Reject malformed payloads before they reach the write queue
+    if not isinstance(product_id, int) or isinstance(product_id, bool) or product_id <= 0:
+        return jsonify({'error': 'Valid product ID required'}), 400
+    if interaction_type not in TRACKED_INTERACTION_TYPES:
+        return jsonify({'error': 'Unknown interaction type'}), 400
+    
+    # Writes are batched by a background thread; respond without waiting
+    if current_user.is_authenticated:
+        # Track for authenticated user
+        enqueue_user_interaction(current_user.id, product_id, interaction_type)
+    else:
+        # Track for guest user
+        SessionManager.queue_guest_interaction(product_id, interaction_type)
     
     return jsonify({'status': 'ok'})
 
 @main.route('/product/<int:product_id>')
 def product_detail(product_id):
     """Show product details and track view"""
-    product = Product.query.get_or_404(product_id)
+    # Load the category breadcrumb (subcategory and its parent) with the product
+    product = Product.query.options(
+        db.joinedload(Product.category_obj).joinedload(Category.parent)
+    ).filter_by(id=product_id).first_or_404()
     
-    # Check if this is a recommendation click with discount
+    # Check if this is a recommendation click with discount. Only the
+    # displayed price changes; the product row is never modified.
+    display_discount = product.discount_percentage
     rec_discount = request.args.get('rec_discount', type=float, default=0)
     if rec_discount > 0 and rec_discount <= 100:
         # Apply the recommendation discount if it's valid
-        product.discount_percentage = rec_discount
+        display_discount = max(display_discount, rec_discount)
+    display_price = product.price * (1 - display_discount / 100)
     
     # Track view for both guests and authenticated users
     if current_user.is_authenticated:
-        interaction = UserInteraction(
-            user_id=current_user.id,
-            product_id=product_id,
-            interaction_type='view'
-        )
-        db.session.add(interaction)
-        db.session.commit()
+        enqueue_user_interaction(current_user.id, product_id, 'view')
     else:
-        SessionManager.track_guest_interaction(product_id, 'view')
+        SessionManager.queue_guest_interaction(product_id, 'view')
     
     # Get similar products
     similar_products = Recommender.get_similar_products(product_id, limit=4)
     
     # Get main categories for navigation
-    main_categories = Category.get_main_categories()
+    main_categories = Category.get_main_categories_cached()
     
     return render_template('product.html', 
                          product=product, 
+                         display_discount=display_discount,
+                         display_price=display_price,
                          similar_products=similar_products,
                          main_categories=main_categories)
 
@@ -162,11 +241,17 @@ def category_view(slug):
     """View products in a specific category"""
     category = Category.query.filter_by(slug=slug).first_or_404()
     
-    # Get all products in this category (including subcategories)
-    products = category.get_all_products(include_subcategories=True)
+    # Get one page of products in this category (including subcategories),
+    # loading only the columns the product cards show
+    page = request.args.get('page', 1, type=int)
+    products = Product.query.filter(
+        Product.category_id.in_(category.get_subtree_ids())
+    ).options(
+        load_only(Product.id, Product.name, Product.brand, Product.price, Product.discount_percentage)
+    ).order_by(Product.id).paginate(page=page, per_page=24, error_out=False)
     
     # Get main categories for navigation
-    main_categories = Category.get_main_categories()
+    main_categories = Category.get_main_categories_cached()
     
     # Get breadcrumb path
     breadcrumb = category.get_path()
@@ -180,20 +265,23 @@ def category_view(slug):
 @main.route('/categories')
 def categories_list():
     """Show all categories"""
-    main_categories = Category.get_main_categories()
+    main_categories = Category.query.filter_by(parent_id=None).options(
+        db.selectinload(Category.children)
+    ).order_by(Category.name).all()
     
-    # Build category tree with product counts
+    # Build category tree with product counts from one GROUP BY
+    direct_counts, subtree_counts = Category.get_product_counts()
     category_tree = []
     for main_cat in main_categories:
         category_data = {
             'category': main_cat,
-            'product_count': main_cat.get_product_count(include_subcategories=True),
+            'product_count': subtree_counts.get(main_cat.id, 0),
             'subcategories': []
         }
         for sub_cat in main_cat.children:
             category_data['subcategories'].append({
                 'category': sub_cat,
-                'product_count': sub_cat.get_product_count()
+                'product_count': direct_counts.get(sub_cat.id, 0)
             })
         category_tree.append(category_data)
     
@@ -204,20 +292,33 @@ def categories_list():
 @main.route('/debug/recommendations')
 def debug_recommendations():
     """Debug endpoint to check recommendation system"""
-    from .session_manager import SessionManager
-    from .analytics import AnalyticsEngine
-    
     session_id = SessionManager.get_or_create_session_id()
     
     # Get interaction count for current session
     if current_user.is_authenticated:
         user_type = "authenticated"
         user_id = current_user.id
-        interaction_count = UserInteraction.query.filter_by(user_id=user_id).count()
+        interaction_count_query = db.session.query(func.count(UserInteraction.id)).filter(
+            UserInteraction.user_id == user_id
+        )
     else:
         user_type = "guest"
         user_id = session_id
-        interaction_count = GuestInteraction.query.filter_by(session_id=session_id).count()
+        interaction_count_query = db.session.query(func.count(GuestInteraction.id)).filter(
+            GuestInteraction.session_id == session_id
+        )
+    
+    # Fetch all debug counts in one round-trip
+    interaction_count, total_products, best_sellers_cached, best_sellers_30d, trending_cached = db.session.query(
+        interaction_count_query.scalar_subquery(),
+        db.session.query(func.count(Product.id)).scalar_subquery(),
+        db.session.query(func.count(BestSeller.id)).filter(BestSeller.category == None).scalar_subquery(),
+        db.session.query(func.count(BestSeller.id)).filter(
+            BestSeller.category == None,
+            BestSeller.time_window == '30d'
+        ).scalar_subquery(),
+        db.session.query(func.count(TrendingProduct.id)).filter(TrendingProduct.category == None).scalar_subquery()
+    ).one()
     
     # Get recommendations
     if current_user.is_authenticated:
@@ -225,10 +326,6 @@ def debug_recommendations():
     else:
         recommendations = Recommender.get_recommendations_for_guest(session_id, limit=4)
     
-    # Get analytics data
-    best_sellers = AnalyticsEngine.get_best_sellers(time_window='30d', limit=5)
-    trending = AnalyticsEngine.get_trending_products(limit=5)
-    
     debug_info = {
         'user_type': user_type,
         'user_id': user_id,
@@ -242,12 +339,13 @@ def debug_recommendations():
                 'price': float(r.price)
             } for r in recommendations
         ],
-        'best_sellers_count': len(best_sellers),
-        'trending_count': len(trending),
-        'total_products': Product.query.count(),
+        # Only the sizes of the top-5 lists are reported, so count instead of loading them
+        'best_sellers_count': min(best_sellers_30d, 5),
+        'trending_count': min(trending_cached, 5),
+        'total_products': total_products,
         'analytics_status': {
-            'best_sellers_cached': BestSeller.query.filter_by(category=None).count(),
-            'trending_cached': TrendingProduct.query.filter_by(category=None).count()
+            'best_sellers_cached': best_sellers_cached,
+            'trending_cached': trending_cached
         }
     }
     
@@ -256,8 +354,6 @@ def debug_recommendations():
 @main.route('/deals')
 def deals():
     """Display all available deals and personalized offers"""
-    from .analytics import AnalyticsEngine
-    
     # Get best deals (products with highest discounts)
     best_deals = Product.query.filter(
         Product.discount_percentage > 0,
@@ -267,30 +363,27 @@ def deals():
     # Get personalized offers if user is authenticated
     personalized_offers = []
     if current_user.is_authenticated:
-        offer_generator = OfferGenerator()
-        active_offers = offer_generator.get_active_offers(current_user.id)
+        offer_generator = current_app.extensions['offer_generator']
         
         # Create offer items with product details
-        for offer in active_offers:
+        for offer, product, final_price, savings in offer_generator.get_active_offers_with_prices(current_user.id):
             personalized_offers.append({
-                'product': offer.product,
+                'product': product,
                 'offer': offer,
-                'final_price': offer.product.price * (1 - offer.discount_percentage / 100),
-                'savings': offer.product.price * (offer.discount_percentage / 100)
+                'final_price': final_price,
+                'savings': savings
             })
     
     # Get trending products with discounts
-    analytics = AnalyticsEngine()
-    trending = analytics.get_trending_products(limit=10)
-    trending_deals = []
-    
-    for product in trending:
-        if product.discount_percentage > 0 or product.stock_quantity < 10:
-            trending_deals.append({
-                'product': product,
-                'is_limited_stock': product.stock_quantity < 10,
-                'final_price': product.get_discounted_price()
-            })
+    analytics = current_app.extensions['analytics']
+    trending_deals = [
+        {
+            'product': product,
+            'is_limited_stock': product.stock_quantity < 10,
+            'final_price': product.get_discounted_price()
+        }
+        for product in analytics.get_trending_deals(limit=10)
+    ]
     
     return render_template('deals.html',
                          best_deals=best_deals,
@@ -10,12 +10,27 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from eshop import create_app
 from eshop.models import db, User, Product, Order, OrderItem, UserInteraction, GuestInteraction, BestSeller, TrendingProduct
 from eshop.recommender import Recommender
-from eshop.analytics import AnalyticsEngine
-from eshop.offers import OfferGenerator
 from eshop.hybrid_recommender import HybridRecommender
+from eshop.ab_testing import ABTestingFramework
 from datetime import datetime, timedelta
+from functools import lru_cache
+from sqlalchemy import insert
 import random
 
+
+@lru_cache(maxsize=1)
+def _hybrid():
+    """Build the hybrid recommender once; its sub-recommenders serve the ML sections too"""
+    return HybridRecommender()
+
+
+@lru_cache(maxsize=1)
+def _top_product_ids():
+    """IDs of the first 10 products, shared by the interaction and cart sections"""
+    # Plain ints, unlike ORM rows, are not expired and reloaded after each commit
+    return tuple(product_id for (product_id,) in db.session.query(Product.id).limit(10))
+
+
 def test_all_algorithms():
     """Test all personalization algorithms"""
     app = create_app()
@@ -25,14 +40,16 @@ def test_all_algorithms():
         
         # 1. Test Best Sellers
         print("1. Testing Best Sellers Algorithm...")
-        analytics = AnalyticsEngine()
+        analytics = _hybrid().analytics
         analytics.calculate_best_sellers()
         
-        best_sellers = BestSeller.query.order_by(BestSeller.sales_count.desc()).limit(5).all()
+        best_sellers = BestSeller.query.options(
+            db.joinedload(BestSeller.product)
+        ).order_by(BestSeller.sales_count.desc()).limit(5).all()
         if best_sellers:
             print(f"   ✓ Found {len(best_sellers)} best sellers")
             for bs in best_sellers[:3]:
-                product = Product.query.get(bs.product_id)
+                product = bs.product
                 if product:
                     print(f"     - {product.name}: sales={bs.sales_count}")
         else:
@@ -42,11 +59,13 @@ def test_all_algorithms():
         print("\n2. Testing Trending Products Algorithm...")
         analytics.calculate_trending_products()
         
-        trending = TrendingProduct.query.order_by(TrendingProduct.trending_score.desc()).limit(5).all()
+        trending = TrendingProduct.query.options(
+            db.joinedload(TrendingProduct.product)
+        ).order_by(TrendingProduct.trending_score.desc()).limit(5).all()
         if trending:
             print(f"   ✓ Found {len(trending)} trending products")
             for tp in trending[:3]:
-                product = Product.query.get(tp.product_id)
+                product = tp.product
                 if product:
                     print(f"     - {product.name}: score={tp.trending_score:.2f}")
         else:
@@ -60,21 +79,22 @@ def test_all_algorithms():
         initial_recs = Recommender.get_recommendations_for_guest(session_id, limit=10)
         print(f"   ✓ Initial recommendations: {len(initial_recs)} products")
         
-        # Add some interactions
-        products = Product.query.limit(5).all()
-        for i, product in enumerate(products):
-            interaction = GuestInteraction(
-                session_id=session_id,
-                product_id=product.id,
-                interaction_type='view',
-                timestamp=datetime.utcnow() - timedelta(minutes=i)
-            )
-            db.session.add(interaction)
-        db.session.commit()
-        
-        # Test cold start after interactions
-        cold_start_recs = Recommender.get_recommendations_for_guest(session_id, limit=10)
-        print(f"   ✓ Cold start recommendations after 5 interactions: {len(cold_start_recs)} products")
+        # Add some interactions inside a SAVEPOINT so reruns start from the same 5
+        savepoint = db.session.begin_nested()
+        try:
+            product_ids = _top_product_ids()[:5]
+            now = datetime.utcnow()
+            db.session.execute(insert(GuestInteraction), [
+                {'session_id': session_id, 'product_id': product_id,
+                 'interaction_type': 'view', 'timestamp': now - timedelta(minutes=i)}
+                for i, product_id in enumerate(product_ids)
+            ])
+            
+            # Test cold start after interactions
+            cold_start_recs = Recommender.get_recommendations_for_guest(session_id, limit=10)
+            print(f"   ✓ Cold start recommendations after 5 interactions: {len(cold_start_recs)} products")
+        finally:
+            savepoint.rollback()
         
         # 4. Test Authenticated User Recommendations
         print("\n4. Testing Authenticated User Recommendations...")
@@ -92,15 +112,13 @@ def test_all_algorithms():
         print(f"   ✓ New user recommendations: {len(new_user_recs)} products")
         
         # Add interactions for the user
-        products = Product.query.limit(10).all()
-        for i, product in enumerate(products):
-            interaction = UserInteraction(
-                user_id=test_user.id,
-                product_id=product.id,
-                interaction_type='view',
-                timestamp=datetime.utcnow() - timedelta(hours=i)
-            )
-            db.session.add(interaction)
+        product_ids = _top_product_ids()
+        now = datetime.utcnow()
+        db.session.execute(insert(UserInteraction), [
+            {'user_id': test_user.id, 'product_id': product_id,
+             'interaction_type': 'view', 'timestamp': now - timedelta(hours=i)}
+            for i, product_id in enumerate(product_ids)
+        ])
         db.session.commit()
         
         # Test with minimal data
@@ -109,7 +127,7 @@ def test_all_algorithms():
         
         # 5. Test Hybrid Recommender
         print("\n5. Testing Hybrid Recommender...")
-        hybrid = HybridRecommender()
+        hybrid = _hybrid()
         
         # Test weight configuration
         print(f"   ✓ Algorithm weight configurations:")
@@ -117,19 +135,23 @@ def test_all_algorithms():
         print(f"     - Minimal data users: {hybrid.weights['minimal_data']}")
         print(f"     - Established users: {hybrid.weights['established_user']}")
             
+        # Load the user's SVM features once for the hybrid and SVM sections
+        user_vec = hybrid.svm_recommender.build_user_vector(test_user.id)
+        
         # Get hybrid recommendations
-        hybrid_recs = hybrid.get_recommendations(test_user.id, limit=10)
+        hybrid_recs = hybrid.get_recommendations(test_user.id, limit=10, precomputed_user_vec=user_vec)
         print(f"   ✓ Hybrid recommendations: {len(hybrid_recs)} products")
         
         # 6. Test Linear SVM
         print("\n6. Testing Linear SVM Recommender...")
         try:
-            from eshop.ml_recommenders import LinearSVMRecommender
-            svm = LinearSVMRecommender()
+            svm = _hybrid().svm_recommender
             
-            # Train the model if enough data
-            if svm.train_model():
-                svm_recs = svm.get_recommendations(test_user.id, limit=5)
+            # The model is trained per user inside get_recommendations
+            candidates = Product.query.filter(Product.stock_quantity > 0).all()
+            svm_recs = svm.get_recommendations(test_user.id, candidates, limit=5,
+                                               precomputed_user_vec=user_vec)
+            if svm_recs:
                 print(f"   ✓ Linear SVM recommendations: {len(svm_recs)} products")
             else:
                 print("   ⚠ Not enough data to train Linear SVM")
@@ -139,8 +161,7 @@ def test_all_algorithms():
         # 7. Test Advanced Neighbors
         print("\n7. Testing Advanced Neighbors Recommender...")
         try:
-            from eshop.ml_recommenders import AdvancedNeighborsRecommender
-            neighbors = AdvancedNeighborsRecommender()
+            neighbors = _hybrid().neighbors_recommender
             
             neighbor_recs = neighbors.get_recommendations(test_user.id, limit=5)
             print(f"   ✓ Advanced Neighbors recommendations: {len(neighbor_recs)} products")
@@ -150,12 +171,10 @@ def test_all_algorithms():
         # 8. Test Shopping Cart Recommender
         print("\n8. Testing Shopping Cart Recommender...")
         try:
-            from eshop.shopping_cart_recommender import ShoppingCartRecommender
-            cart_rec = ShoppingCartRecommender()
+            cart_rec = _hybrid().cart_recommender
             
             # Create a sample cart
-            cart_items = Product.query.limit(3).all()
-            cart_product_ids = [p.id for p in cart_items]
+            cart_product_ids = list(_top_product_ids()[:3])
             
             cart_recs = cart_rec.get_recommendations_for_cart(cart_product_ids, limit=5)
             print(f"   ✓ Shopping cart recommendations for {len(cart_product_ids)} items: {len(cart_recs)} products")
@@ -164,7 +183,7 @@ def test_all_algorithms():
             
         # 9. Test Personalized Offers
         print("\n9. Testing Personalized Offers...")
-        offer_gen = OfferGenerator()
+        offer_gen = app.extensions['offer_generator']
         
         # Generate offers for the test user
         offers = offer_gen.generate_offers_for_user(test_user.id, num_offers=4)
@@ -177,7 +196,6 @@ def test_all_algorithms():
         # 10. Test A/B Testing Framework
         print("\n10. Testing A/B Testing Framework...")
         try:
-            from eshop.ab_testing import ABTestingFramework
             ab_test = ABTestingFramework()
             
             # Create a test experiment
@@ -3,41 +3,95 @@ Pytest configuration and fixtures for recommendation system testing
 """
 
 import pytest
-import tempfile
 import os
 import sys
 from datetime import datetime, timedelta
+from flask_sqlalchemy.session import _app_ctx_id
+from sqlalchemy import event, insert
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from werkzeug.security import generate_password_hash
 
 # Add the src directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 from eshop import create_app
-from eshop.models import db, User, Product, Order, OrderItem, UserInteraction, GuestInteraction, Category
+from eshop.models import db, User, Product, Order, OrderItem, UserInteraction, Category
 from eshop.analytics import AnalyticsEngine
+from eshop.recommendation_cache import get_cache
+from eshop import shopping_cart_recommender
 
 
-@pytest.fixture
-def app():
-    """Create and configure a test Flask application"""
-    # Create a temporary database file
-    db_fd, db_path = tempfile.mkstemp()
-    
-    # Create app with test config
-    app = create_app()
-    app.config.update({
+def _clear_process_caches():
+    """Drop in-process caches that would otherwise outlive a rolled-back test"""
+    get_cache().clear()
+    Category._main_categories_cache.clear()
+    shopping_cart_recommender._assoc_cache.clear()
+    shopping_cart_recommender._product_cache.clear()
+
+
+@pytest.fixture(scope='session')
+def _app():
+    """Create the Flask application and schema once for the whole test session"""
+    # In-memory database shared by every session through a single connection
+    app = create_app({
         'TESTING': True,
-        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{db_path}',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'SQLALCHEMY_ENGINE_OPTIONS': {
+            'poolclass': StaticPool,
+            'connect_args': {'check_same_thread': False}
+        },
         'SECRET_KEY': 'test-secret-key',
-        'WTF_CSRF_ENABLED': False
+        'WTF_CSRF_ENABLED': False,
+        'SYNC_TRACK': True
     })
     
     with app.app_context():
+        # pysqlite only honours SAVEPOINT when SQLAlchemy issues BEGIN itself
+        @event.listens_for(db.engine, 'connect')
+        def _disable_pysqlite_transactions(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+        
+        # StaticPool keeps create_app's single connection for the whole session;
+        # the database already lives in memory, so keep temp sort/index b-trees there too
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('PRAGMA temp_store=MEMORY')
+        
+        @event.listens_for(db.engine, 'begin')
+        def _emit_begin(connection):
+            connection.exec_driver_sql('BEGIN')
+        
         db.create_all()
-        yield app
+    
+    return app
+
+
+@pytest.fixture
+def app(_app):
+    """Run each test inside an outer transaction that is rolled back afterwards"""
+    with _app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
         
-    # Clean up
-    os.close(db_fd)
-    os.unlink(db_path)
+        # Session commits become SAVEPOINT releases inside the outer transaction
+        original_session = db.session
+        db.session = scoped_session(
+            sessionmaker(
+                bind=connection,
+                join_transaction_mode='create_savepoint',
+                query_cls=db.Query
+            ),
+            scopefunc=_app_ctx_id
+        )
+        _clear_process_caches()
+        
+        try:
+            yield _app
+        finally:
+            db.session.remove()
+            transaction.rollback()
+            connection.close()
+            db.session = original_session
 
 
 @pytest.fixture
@@ -46,149 +100,183 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture
+def sql_queries(app):
+    """Record every SQL statement executed while the test runs"""
+    queries = []
+    
+    def record(conn, cursor, statement, parameters, context, executemany):
+        # Savepoints come from the per-test transaction, not from the code under test
+        if not statement.startswith(('SAVEPOINT', 'RELEASE', 'ROLLBACK TO')):
+            queries.append(statement)
+    
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', record)
+        yield queries
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
 @pytest.fixture
 def runner(app):
     """Create a test CLI runner"""
     return app.test_cli_runner()
 
 
+@pytest.fixture(scope='session')
+def password_hash():
+    """Hash of the shared sample-user password, computed once per session"""
+    return generate_password_hash('password123')
+
+
 @pytest.fixture
-def sample_users(app):
+def sample_users(app, password_hash):
     """Create sample users for testing"""
-    with app.app_context():
-        users = [
-            User(email='newuser@test.com'),  # New user with no interactions
-            User(email='casual@test.com'),    # Casual user with some interactions
-            User(email='active@test.com'),    # Active user with many interactions
-            User(email='vip@test.com')        # VIP user with purchase history
-        ]
-        
-        for user in users:
-            user.set_password('password123')
-            db.session.add(user)
-        
-        db.session.commit()
-        return users
+    emails = [
+        'newuser@test.com',  # New user with no interactions
+        'casual@test.com',   # Casual user with some interactions
+        'active@test.com',   # Active user with many interactions
+        'vip@test.com'       # VIP user with purchase history
+    ]
+    
+    db.session.execute(insert(User), [
+        {'email': email, 'password_hash': password_hash} for email in emails
+    ])
+    db.session.commit()
+    
+    users_by_email = {u.email: u for u in User.query.filter(User.email.in_(emails))}
+    return [users_by_email[email] for email in emails]
 
 
 @pytest.fixture
 def sample_products(app):
     """Create sample products across different categories"""
-    with app.app_context():
-        categories = ['Electronics', 'Books', 'Clothing', 'Home', 'Sports']
-        products = []
-        
-        for i in range(50):
-            product = Product(
-                name=f'Product {i+1}',
-                price=10.0 + (i * 5) % 200,
-                category=categories[i % len(categories)],
-                description=f'Description for product {i+1}',
-                brand=f'Brand{i % 5}',
-                tags=f'tag{i % 3},tag{i % 4}',
-                stock_quantity=100 - (i % 10) * 10,
-                discount_percentage=0 if i % 5 else 10  # Every 5th product has discount
-            )
-            products.append(product)
-            db.session.add(product)
-        
-        db.session.commit()
-        return products
+    categories = ['Electronics', 'Books', 'Clothing', 'Home', 'Sports']
+    category_ids = db.session.scalars(
+        insert(Category).returning(Category.id, sort_by_parameter_order=True),
+        [{'name': name, 'slug': name.lower()} for name in categories]
+    ).all()
+    
+    rows = [
+        {
+            'name': f'Product {i+1}',
+            'price': 10.0 + (i * 5) % 200,
+            'category': categories[i % len(categories)],
+            'category_id': category_ids[i % len(categories)],
+            'description': f'Description for product {i+1}',
+            'brand': f'Brand{i % 5}',
+            'tags': f'tag{i % 3},tag{i % 4}',
+            'stock_quantity': 100 - (i % 10) * 10,
+            'discount_percentage': 0 if i % 5 else 10  # Every 5th product has discount
+        }
+        for i in range(50)
+    ]
+    product_ids = db.session.scalars(
+        insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+    ).all()
+    db.session.commit()
+    
+    products_by_id = {p.id: p for p in Product.query.filter(Product.id.in_(product_ids))}
+    return [products_by_id[product_id] for product_id in product_ids]
 
 
 @pytest.fixture
 def sample_interactions(app, sample_users, sample_products):
     """Create sample user interactions for different user segments"""
-    with app.app_context():
-        interactions = []
-        
-        # New user - no interactions
-        # (User 0 has no interactions)
-        
-        # Casual user - 8 interactions
-        for i in range(8):
-            interaction = UserInteraction(
-                user_id=sample_users[1].id,
-                product_id=sample_products[i].id,
-                interaction_type=['view', 'click', 'view'][i % 3],
-                timestamp=datetime.utcnow() - timedelta(days=i)
-            )
-            interactions.append(interaction)
-            db.session.add(interaction)
-        
-        # Active user - 25 interactions with some purchases
-        for i in range(25):
-            interaction = UserInteraction(
-                user_id=sample_users[2].id,
-                product_id=sample_products[i % 20].id,
-                interaction_type=['view', 'click', 'purchase', 'add_to_cart'][i % 4],
-                timestamp=datetime.utcnow() - timedelta(days=i//2)
-            )
-            interactions.append(interaction)
-            db.session.add(interaction)
-        
-        # VIP user - 50+ interactions with many purchases
-        for i in range(50):
-            interaction = UserInteraction(
-                user_id=sample_users[3].id,
-                product_id=sample_products[i % 30].id,
-                interaction_type=['view', 'click', 'purchase', 'purchase'][i % 4],
-                timestamp=datetime.utcnow() - timedelta(days=i//3)
-            )
-            interactions.append(interaction)
-            db.session.add(interaction)
-        
-        db.session.commit()
-        return interactions
+    now = datetime.utcnow()
+    
+    # New user - no interactions
+    # (User 0 has no interactions)
+    
+    # Casual user - 8 interactions
+    rows = [
+        {
+            'user_id': sample_users[1].id,
+            'product_id': sample_products[i].id,
+            'interaction_type': ['view', 'click', 'view'][i % 3],
+            'timestamp': now - timedelta(days=i)
+        }
+        for i in range(8)
+    ]
+    
+    # Active user - 25 interactions with some purchases
+    rows += [
+        {
+            'user_id': sample_users[2].id,
+            'product_id': sample_products[i % 20].id,
+            'interaction_type': ['view', 'click', 'purchase', 'add_to_cart'][i % 4],
+            'timestamp': now - timedelta(days=i//2)
+        }
+        for i in range(25)
+    ]
+    
+    # VIP user - 50+ interactions with many purchases
+    rows += [
+        {
+            'user_id': sample_users[3].id,
+            'product_id': sample_products[i % 30].id,
+            'interaction_type': ['view', 'click', 'purchase', 'purchase'][i % 4],
+            'timestamp': now - timedelta(days=i//3)
+        }
+        for i in range(50)
+    ]
+    
+    # One executemany instead of 83 ORM inserts
+    db.session.execute(insert(UserInteraction), rows)
+    db.session.commit()
+    
+    user_ids = [user.id for user in sample_users[1:]]
+    return UserInteraction.query.filter(UserInteraction.user_id.in_(user_ids)).all()
 
 
 @pytest.fixture
 def sample_orders(app, sample_users, sample_products):
     """Create sample orders for testing shopping cart recommendations"""
-    with app.app_context():
-        orders = []
-        
-        # Create orders with common product combinations
-        order_patterns = [
-            [0, 1, 2],      # Products often bought together
-            [0, 1, 3],      # Another combination with product 0 and 1
-            [1, 2, 4],      # Products 1 and 2 appear in multiple orders
-            [5, 6, 7],      # Different product set
-            [0, 5, 8],      # Cross-category purchase
-            [1, 2, 3, 4],   # Larger order
+    # Create orders with common product combinations
+    order_patterns = [
+        [0, 1, 2],      # Products often bought together
+        [0, 1, 3],      # Another combination with product 0 and 1
+        [1, 2, 4],      # Products 1 and 2 appear in multiple orders
+        [5, 6, 7],      # Different product set
+        [0, 5, 8],      # Cross-category purchase
+        [1, 2, 3, 4],   # Larger order
+    ]
+    
+    now = datetime.utcnow()
+    
+    # Insert the orders first, then their items against the returned ids
+    order_ids = db.session.scalars(
+        insert(Order).returning(Order.id, sort_by_parameter_order=True),
+        [
+            {
+                'user_id': sample_users[2 + i % 2].id,  # Alternate between active and VIP users
+                'total': sum(sample_products[p].price for p in pattern),
+                'created_at': now - timedelta(days=30-i*5)
+            }
+            for i, pattern in enumerate(order_patterns)
         ]
-        
-        for i, pattern in enumerate(order_patterns):
-            order = Order(
-                user_id=sample_users[2 + i % 2].id,  # Alternate between active and VIP users
-                total=sum(sample_products[p].price for p in pattern),
-                created_at=datetime.utcnow() - timedelta(days=30-i*5)
-            )
-            db.session.add(order)
-            db.session.flush()
-            
-            for product_idx in pattern:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=sample_products[product_idx].id,
-                    quantity=1,
-                    price=sample_products[product_idx].price
-                )
-                db.session.add(order_item)
-            
-            orders.append(order)
-        
-        db.session.commit()
-        return orders
+    ).all()
+    
+    db.session.execute(insert(OrderItem), [
+        {
+            'order_id': order_id,
+            'product_id': sample_products[product_idx].id,
+            'quantity': 1,
+            'price': sample_products[product_idx].price
+        }
+        for order_id, pattern in zip(order_ids, order_patterns)
+        for product_idx in pattern
+    ])
+    db.session.commit()
+    
+    return Order.query.filter(Order.id.in_(order_ids)).order_by(Order.id).all()
 
 
 @pytest.fixture
 def analytics_engine(app, sample_orders):
     """Initialize analytics engine with sample data"""
-    with app.app_context():
-        engine = AnalyticsEngine()
-        engine.update_analytics()  # Calculate best sellers and trending
-        return engine
+    engine = AnalyticsEngine()
+    engine.update_analytics()  # Calculate best sellers and trending
+    return engine
 
 
 @pytest.fixture
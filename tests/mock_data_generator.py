@@ -3,110 +3,177 @@ Mock data generator for comprehensive testing of recommendation system
 """
 
 import random
-from datetime import datetime, timedelta
+import uuid
+import numpy as np
+from datetime import datetime
 from faker import Faker
-from eshop.models import db, User, Product, Order, OrderItem, UserInteraction, GuestInteraction
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+from eshop.models import db, User, Product, Order, OrderItem, UserInteraction, GuestInteraction, Category
 
 
 class MockDataGenerator:
     """Generate realistic mock data for testing recommendation algorithms"""
     
-    def __init__(self):
-        self.fake = Faker()
+    # Hash of the shared mock password, computed once per process
+    _password_hash = None
+    
+    def __init__(self, seed=None):
+        # Frequency-weighted word lists aren't needed for mock data
+        self.fake = Faker(use_weighting=False)
+        if seed is not None:
+            self.fake.seed_instance(seed)
         self.categories = ['Electronics', 'Books', 'Clothing', 'Home', 'Sports', 'Beauty', 'Toys', 'Food']
         self.brands = ['BrandA', 'BrandB', 'BrandC', 'BrandD', 'BrandE']
         self.interaction_types = ['view', 'click', 'add_to_cart', 'purchase']
+        # Weights over interaction_types per mock user type; '' covers users without one
+        self.interaction_weights = {
+            'new': [0.7, 0.2, 0.08, 0.02],      # New users mostly view
+            'casual': [0.5, 0.3, 0.15, 0.05],   # Casual users view and click
+            'regular': [0.4, 0.3, 0.2, 0.1],    # Regular users have balanced behavior
+            'vip': [0.3, 0.3, 0.2, 0.2],        # VIP users purchase more
+            '': [0.4, 0.3, 0.2, 0.1]
+        }
+        # Instance-level RNGs so a seed reproduces the whole dataset
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
         
-    def generate_users(self, count=100):
+    @staticmethod
+    def _ago(offsets, unit):
+        """Convert an array of offsets (numpy timedelta64 unit, e.g. 'D' or 'm') to datetimes before now"""
+        now = np.datetime64(datetime.utcnow(), 'us')
+        return (now - np.asarray(offsets, dtype=np.int64).astype(f'timedelta64[{unit}]')).tolist()
+    
+    def generate_users(self, count=100, commit=True):
         """Generate mock users with different behavior patterns"""
-        users = []
         user_types = ['new', 'casual', 'regular', 'vip']
         
-        for i in range(count):
-            user_type = user_types[i % len(user_types)]
-            user = User(
-                email=f'{user_type}_{i}@test.com',
-                created_at=datetime.utcnow() - timedelta(days=random.randint(1, 365))
-            )
-            user.set_password('password123')
-            user._mock_type = user_type  # Store type for testing
-            users.append(user)
-            db.session.add(user)
+        # Every mock user shares one password, so hash it once per process
+        if MockDataGenerator._password_hash is None:
+            MockDataGenerator._password_hash = generate_password_hash('password123')
         
-        db.session.commit()
+        created_at = self._ago(self.rng.integers(1, 366, size=count), 'D')
+        
+        user_ids = db.session.scalars(
+            insert(User).returning(User.id, sort_by_parameter_order=True),
+            [
+                {
+                    'email': f'{user_types[i % len(user_types)]}_{i}@test.com',
+                    'password_hash': MockDataGenerator._password_hash,
+                    'created_at': created_at[i]
+                }
+                for i in range(count)
+            ]
+        ).all()
+        if commit:
+            db.session.commit()
+        
+        users = User.query.filter(User.id.in_(user_ids)).order_by(User.id).all()
+        for i, user in enumerate(users):
+            user._mock_type = user_types[i % len(user_types)]  # Store type for testing
         return users
     
-    def generate_products(self, count=500):
+    def generate_products(self, count=500, commit=True):
         """Generate diverse products across categories"""
-        products = []
+        category_ids = self._get_category_ids()
         
-        for i in range(count):
-            category = random.choice(self.categories)
-            base_price = random.uniform(10, 500)
-            
-            product = Product(
-                name=f'{category} Product {self.fake.word().capitalize()} {i}',
-                price=round(base_price, 2),
-                category=category,
-                description=self.fake.text(max_nb_chars=200),
-                brand=random.choice(self.brands),
-                tags=','.join([f'tag{random.randint(1, 20)}' for _ in range(random.randint(2, 5))]),
-                stock_quantity=random.randint(0, 1000),
-                discount_percentage=0 if random.random() > 0.2 else random.choice([5, 10, 15, 20]),
-                created_at=datetime.utcnow() - timedelta(days=random.randint(1, 180))
-            )
-            products.append(product)
-            db.session.add(product)
+        # Draw every random column for the batch up front
+        categories = self.rng.choice(self.categories, size=count).tolist()
+        prices = np.round(self.rng.uniform(10, 500, size=count), 2).tolist()
+        brands = self.rng.choice(self.brands, size=count).tolist()
+        tag_pool = np.array([f'tag{n}' for n in range(1, 21)])
+        tag_counts = self.rng.integers(2, 6, size=count)
+        tags = np.split(tag_pool[self.rng.integers(len(tag_pool), size=tag_counts.sum())], np.cumsum(tag_counts)[:-1])
+        stock = self.rng.integers(0, 1001, size=count).tolist()
+        discounts = np.where(
+            self.rng.random(size=count) < 0.2, self.rng.choice([5, 10, 15, 20], size=count), 0
+        ).tolist()
+        created_at = self._ago(self.rng.integers(1, 181, size=count), 'D')
         
-        db.session.commit()
-        return products
+        rows = [
+            {
+                'name': f'{categories[i]} Product {self.fake.word().capitalize()} {i}',
+                'price': prices[i],
+                'category': categories[i],
+                'category_id': category_ids[categories[i]],
+                'description': self.fake.text(max_nb_chars=200),
+                'brand': brands[i],
+                'tags': ','.join(tags[i]),
+                'stock_quantity': stock[i],
+                'discount_percentage': discounts[i],
+                'created_at': created_at[i]
+            }
+            for i in range(count)
+        ]
+        
+        product_ids = db.session.scalars(
+            insert(Product).returning(Product.id, sort_by_parameter_order=True), rows
+        ).all()
+        if commit:
+            db.session.commit()
+        
+        return Product.query.filter(Product.id.in_(product_ids)).order_by(Product.id).all()
     
-    def generate_interactions(self, users, products, interaction_count=5000):
-        """Generate realistic user interactions based on user types"""
-        interactions = []
+    def _get_category_ids(self):
+        """Map each mock category name to its Category row id, creating missing rows"""
+        slugs = {name: name.lower().replace(' ', '-') for name in self.categories}
+        ids_by_slug = dict(
+            db.session.query(Category.slug, Category.id).filter(Category.slug.in_(slugs.values()))
+        )
         
-        for _ in range(interaction_count):
-            user = random.choice(users)
-            product = random.choice(products)
-            
-            # Interaction probability based on user type
-            if hasattr(user, '_mock_type'):
-                if user._mock_type == 'new':
-                    # New users mostly view
-                    weights = [0.7, 0.2, 0.08, 0.02]
-                elif user._mock_type == 'casual':
-                    # Casual users view and click
-                    weights = [0.5, 0.3, 0.15, 0.05]
-                elif user._mock_type == 'regular':
-                    # Regular users have balanced behavior
-                    weights = [0.4, 0.3, 0.2, 0.1]
-                else:  # vip
-                    # VIP users purchase more
-                    weights = [0.3, 0.3, 0.2, 0.2]
-            else:
-                weights = [0.4, 0.3, 0.2, 0.1]
-            
-            interaction_type = random.choices(self.interaction_types, weights=weights)[0]
-            
-            interaction = UserInteraction(
-                user_id=user.id,
-                product_id=product.id,
-                interaction_type=interaction_type,
-                timestamp=datetime.utcnow() - timedelta(
-                    days=random.randint(0, 30),
-                    hours=random.randint(0, 23),
-                    minutes=random.randint(0, 59)
-                )
-            )
-            interactions.append(interaction)
-            db.session.add(interaction)
+        missing = [{'name': name, 'slug': slug} for name, slug in slugs.items() if slug not in ids_by_slug]
+        if missing:
+            new_ids = db.session.scalars(
+                insert(Category).returning(Category.id, sort_by_parameter_order=True), missing
+            ).all()
+            ids_by_slug.update(zip((row['slug'] for row in missing), new_ids))
         
-        db.session.commit()
+        return {name: ids_by_slug[slug] for name, slug in slugs.items()}
+    
+    def generate_interactions(self, users, products, interaction_count=5000, commit=True):
+        """Generate realistic user interactions based on user types, returned as row dicts"""
+        user_idx = self.rng.integers(len(users), size=interaction_count)
+        product_idx = self.rng.integers(len(products), size=interaction_count)
+        
+        # Interaction probability based on user type, sampled per type bucket
+        mock_types = np.array([getattr(user, '_mock_type', '') for user in users])[user_idx]
+        type_idx = np.empty(interaction_count, dtype=np.intp)
+        for mock_type in np.unique(mock_types):
+            bucket = mock_types == mock_type
+            weights = self.interaction_weights.get(mock_type, self.interaction_weights[''])
+            type_idx[bucket] = self.rng.choice(len(self.interaction_types), size=bucket.sum(), p=weights)
+        
+        offsets = (
+            self.rng.integers(0, 31, size=interaction_count) * 1440
+            + self.rng.integers(0, 24, size=interaction_count) * 60
+            + self.rng.integers(0, 60, size=interaction_count)
+        )
+        timestamps = self._ago(offsets, 'm')
+        
+        user_ids = np.array([user.id for user in users])[user_idx].tolist()
+        product_ids = np.array([product.id for product in products])[product_idx].tolist()
+        interaction_types = np.array(self.interaction_types)[type_idx].tolist()
+        
+        interactions = [
+            {
+                'user_id': user_ids[i],
+                'product_id': product_ids[i],
+                'interaction_type': interaction_types[i],
+                'timestamp': timestamps[i]
+            }
+            for i in range(interaction_count)
+        ]
+        
+        # One executemany instead of an ORM INSERT per interaction
+        db.session.execute(insert(UserInteraction), interactions)
+        if commit:
+            db.session.commit()
         return interactions
     
-    def generate_orders_with_patterns(self, users, products, order_count=200):
+    def generate_orders_with_patterns(self, users, products, order_count=200, commit=True):
         """Generate orders with realistic buying patterns"""
-        orders = []
+        order_rows = []
+        order_items = []
         
         # Define product bundles (frequently bought together)
         bundles = [
@@ -122,103 +189,151 @@ class MockDataGenerator:
             ['bed', 'sheets', 'pillows']
         ]
         
+        buyers = [u for u in users if getattr(u, '_mock_type', None) in ('regular', 'vip')]
+        # The loop only needs ids and prices, so work on plain ints rather than ORM objects
+        product_ids = [p.id for p in products]
+        ids_by_category = self._group_ids_by_category(products)
+        price_of = {p.id: p.get_discounted_price() for p in products}
+        
         for _ in range(order_count):
-            user = random.choice([u for u in users if hasattr(u, '_mock_type') and u._mock_type in ['regular', 'vip']])
+            user = self.random.choice(buyers)
             
             # 30% chance of buying a bundle
-            if random.random() < 0.3 and len(products) > 3:
+            if self.random.random() < 0.3 and len(products) > 3:
                 # Select 2-4 related products
-                num_items = random.randint(2, 4)
+                num_items = self.random.randint(2, 4)
                 # Products from same category are more likely to be bought together
-                category = random.choice(self.categories)
-                category_products = [p for p in products if p.category == category]
-                if len(category_products) >= num_items:
-                    order_products = random.sample(category_products, num_items)
+                category = self.random.choice(self.categories)
+                category_ids = ids_by_category.get(category, [])
+                if len(category_ids) >= num_items:
+                    order_product_ids = self.random.sample(category_ids, num_items)
                 else:
-                    order_products = random.sample(products, num_items)
+                    order_product_ids = self.random.sample(product_ids, num_items)
             else:
                 # Random selection
-                num_items = random.randint(1, 5)
-                order_products = random.sample(products, num_items)
-            
-            order = Order(
-                user_id=user.id,
-                total=sum(p.get_discounted_price() for p in order_products),
-                created_at=datetime.utcnow() - timedelta(days=random.randint(0, 60))
-            )
-            db.session.add(order)
-            db.session.flush()
+                num_items = self.random.randint(1, 5)
+                order_product_ids = self.random.sample(product_ids, num_items)
             
-            for product in order_products:
-                order_item = OrderItem(
-                    order_id=order.id,
-                    product_id=product.id,
-                    quantity=random.randint(1, 3),
-                    price=product.get_discounted_price()
-                )
-                db.session.add(order_item)
+            order_rows.append({
+                'user_id': user.id,
+                'total': sum(price_of[product_id] for product_id in order_product_ids)
+            })
             
-            orders.append(order)
+            order_items.append([
+                {
+                    'product_id': product_id,
+                    'quantity': self.random.randint(1, 3),
+                    'price': price_of[product_id]
+                }
+                for product_id in order_product_ids
+            ])
         
-        db.session.commit()
-        return orders
+        created_at = self._ago(self.rng.integers(0, 61, size=len(order_rows)), 'D')
+        for row, ordered_at in zip(order_rows, created_at):
+            row['created_at'] = ordered_at
+        
+        # Insert the orders first, then their items against the returned ids
+        order_ids = db.session.scalars(
+            insert(Order).returning(Order.id, sort_by_parameter_order=True),
+            order_rows
+        ).all()
+        
+        db.session.execute(insert(OrderItem), [
+            dict(item, order_id=order_id)
+            for order_id, items in zip(order_ids, order_items)
+            for item in items
+        ])
+        
+        # Checkout records a purchase interaction for every ordered item
+        db.session.execute(insert(UserInteraction), [
+            {
+                'user_id': row['user_id'],
+                'product_id': item['product_id'],
+                'interaction_type': 'purchase',
+                'timestamp': row['created_at']
+            }
+            for row, items in zip(order_rows, order_items)
+            for item in items
+        ])
+        if commit:
+            db.session.commit()
+        
+        return Order.query.filter(Order.id.in_(order_ids)).order_by(Order.id).all()
     
-    def generate_guest_sessions(self, products, session_count=50):
-        """Generate guest user sessions with interactions"""
+    @staticmethod
+    def _group_ids_by_category(products):
+        """Index product ids by category name so per-order lookups don't rescan the list"""
+        ids_by_category = {}
+        for product in products:
+            ids_by_category.setdefault(product.category, []).append(product.id)
+        return ids_by_category
+    
+    def generate_guest_sessions(self, products, session_count=50, commit=True):
+        """Generate guest user sessions with interactions, returned as row dicts"""
         sessions = []
+        minutes_ago = []
+        product_ids = [p.id for p in products]
+        ids_by_category = self._group_ids_by_category(products)
         
         for i in range(session_count):
-            session_id = f'guest-session-{i}-{self.fake.uuid4()}'
+            # Seeded random UUID without going through Faker's provider stack
+            session_id = f'guest-session-{i}-{uuid.UUID(int=self.random.getrandbits(128), version=4)}'
             
             # Guest users typically have fewer interactions
-            num_interactions = random.randint(1, 10)
+            num_interactions = self.random.randint(1, 10)
             
             # Guests often browse within a category
-            if random.random() < 0.7:
-                category = random.choice(self.categories)
-                category_products = [p for p in products if p.category == category]
-                session_products = random.sample(
-                    category_products if len(category_products) >= num_interactions else products,
-                    min(num_interactions, len(category_products))
+            if self.random.random() < 0.7:
+                category = self.random.choice(self.categories)
+                category_ids = ids_by_category.get(category, [])
+                session_product_ids = self.random.sample(
+                    category_ids if len(category_ids) >= num_interactions else product_ids,
+                    min(num_interactions, len(category_ids))
                 )
             else:
-                session_products = random.sample(products, num_interactions)
+                session_product_ids = self.random.sample(product_ids, num_interactions)
             
-            for j, product in enumerate(session_products):
-                # Guests mostly view and click
-                interaction_type = random.choices(
-                    ['view', 'click', 'add_to_cart'],
-                    weights=[0.6, 0.3, 0.1]
-                )[0]
-                
-                interaction = GuestInteraction(
-                    session_id=session_id,
-                    product_id=product.id,
-                    interaction_type=interaction_type,
-                    timestamp=datetime.utcnow() - timedelta(minutes=num_interactions-j)
-                )
-                db.session.add(interaction)
-                sessions.append(interaction)
+            for j, product_id in enumerate(session_product_ids):
+                sessions.append({
+                    'session_id': session_id,
+                    'product_id': product_id
+                })
+                minutes_ago.append(num_interactions - j)
         
-        db.session.commit()
+        # Guests mostly view and click
+        interaction_types = self.rng.choice(
+            ['view', 'click', 'add_to_cart'], size=len(sessions), p=[0.6, 0.3, 0.1]
+        ).tolist()
+        timestamps = self._ago(minutes_ago, 'm')
+        for row, interaction_type, timestamp in zip(sessions, interaction_types, timestamps):
+            row['interaction_type'] = interaction_type
+            row['timestamp'] = timestamp
+        
+        if sessions:
+            db.session.execute(insert(GuestInteraction), sessions)
+        if commit:
+            db.session.commit()
         return sessions
     
     def generate_complete_test_dataset(self):
-        """Generate a complete dataset for testing"""
-        print("Generating users...")
-        users = self.generate_users(100)
-        
-        print("Generating products...")
-        products = self.generate_products(500)
-        
-        print("Generating interactions...")
-        interactions = self.generate_interactions(users, products, 5000)
-        
-        print("Generating orders...")
-        orders = self.generate_orders_with_patterns(users, products, 200)
+        """Generate a complete dataset for testing in a single transaction"""
+        with db.session.no_autoflush:
+            print("Generating users...")
+            users = self.generate_users(100, commit=False)
+            
+            print("Generating products...")
+            products = self.generate_products(500, commit=False)
+            
+            print("Generating interactions...")
+            interactions = self.generate_interactions(users, products, 5000, commit=False)
+            
+            print("Generating orders...")
+            orders = self.generate_orders_with_patterns(users, products, 200, commit=False)
+            
+            print("Generating guest sessions...")
+            guest_sessions = self.generate_guest_sessions(products, 50, commit=False)
         
-        print("Generating guest sessions...")
-        guest_sessions = self.generate_guest_sessions(products, 50)
+        db.session.commit()
         
         return {
             'users': users,
@@ -232,6 +347,13 @@ class MockDataGenerator:
 class RecommendationMetrics:
     """Calculate metrics for recommendation quality"""
     
+    @staticmethod
+    def _count_relevant(recommendations, relevant_items):
+        """Count recommendations whose id is relevant, with O(1) membership for any iterable"""
+        if not isinstance(relevant_items, (set, frozenset)):
+            relevant_items = set(relevant_items)
+        return sum(1 for r in recommendations if r.id in relevant_items)
+    
     @staticmethod
     def calculate_precision_at_k(recommendations, relevant_items, k=10):
         """Calculate precision@k metric"""
@@ -239,7 +361,7 @@ class RecommendationMetrics:
             return 0.0
         
         recommendations_k = recommendations[:k]
-        relevant_in_recs = sum(1 for r in recommendations_k if r.id in relevant_items)
+        relevant_in_recs = RecommendationMetrics._count_relevant(recommendations_k, relevant_items)
         
         return relevant_in_recs / min(k, len(recommendations_k))
     
@@ -250,7 +372,7 @@ class RecommendationMetrics:
             return 0.0
         
         recommendations_k = recommendations[:k]
-        relevant_in_recs = sum(1 for r in recommendations_k if r.id in relevant_items)
+        relevant_in_recs = RecommendationMetrics._count_relevant(recommendations_k, relevant_items)
         
         return relevant_in_recs / len(relevant_items)
     
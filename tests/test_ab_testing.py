@@ -11,52 +11,75 @@ from eshop.models import db, User
 class TestABTestingFramework:
     """Test A/B testing functionality"""
     
-    @pytest.fixture
-    def ab_framework(self, app):
-        """Create A/B testing framework instance"""
-        with app.app_context():
+    @pytest.fixture(scope='module')
+    def ab_framework(self, _app):
+        """Create A/B testing framework instance shared by the module"""
+        with _app.app_context():
             return ABTestingFramework()
     
+    @pytest.fixture(scope='module')
+    def sample_experiment(self, _app, ab_framework):
+        """Create a sample experiment shared by the module"""
+        # Committed outside the per-test transaction, so every test's
+        # rollback undoes its own starts and results but keeps this row
+        with _app.app_context():
+            experiment = self._create_sample_experiment(ab_framework)
+            db.session.refresh(experiment)
+        
+        yield experiment
+        
+        with _app.app_context():
+            ABTestExperiment.query.filter_by(id=experiment.id).delete()
+            db.session.commit()
+    
     @pytest.fixture
-    def sample_experiment(self, app, ab_framework):
-        """Create a sample experiment"""
-        with app.app_context():
-            variants = [
-                ExperimentVariant(
-                    name="control",
-                    description="Current algorithm mix",
-                    algorithm_weights={
-                        'linear_svm': 0.3,
-                        'neighbors': 0.3,
-                        'shopping_cart': 0.2,
-                        'best_sellers': 0.2
-                    },
-                    traffic_percentage=50.0
-                ),
-                ExperimentVariant(
-                    name="svm_heavy",
-                    description="More weight on SVM",
-                    algorithm_weights={
-                        'linear_svm': 0.5,
-                        'neighbors': 0.2,
-                        'shopping_cart': 0.2,
-                        'best_sellers': 0.1
-                    },
-                    traffic_percentage=50.0
-                )
-            ]
-            
-            experiment = ab_framework.create_experiment(
-                name="SVM Weight Test",
-                description="Test if increasing SVM weight improves conversions",
-                variants=variants,
-                metrics=['ctr', 'conversion_rate', 'revenue'],
-                duration_days=14
+    def fresh_experiment(self, app, ab_framework):
+        """Create an experiment owned by a single test"""
+        return self._create_sample_experiment(ab_framework)
+    
+    @pytest.fixture(autouse=True)
+    def reset_active_experiments(self, ab_framework):
+        """Forget experiments started by the previous test"""
+        yield
+        ab_framework.active_experiments.clear()
+    
+    @staticmethod
+    def _create_sample_experiment(ab_framework):
+        """Create the two-variant SVM weight experiment"""
+        variants = [
+            ExperimentVariant(
+                name="control",
+                description="Current algorithm mix",
+                algorithm_weights={
+                    'linear_svm': 0.3,
+                    'neighbors': 0.3,
+                    'shopping_cart': 0.2,
+                    'best_sellers': 0.2
+                },
+                traffic_percentage=50.0
+            ),
+            ExperimentVariant(
+                name="svm_heavy",
+                description="More weight on SVM",
+                algorithm_weights={
+                    'linear_svm': 0.5,
+                    'neighbors': 0.2,
+                    'shopping_cart': 0.2,
+                    'best_sellers': 0.1
+                },
+                traffic_percentage=50.0
             )
-            
-            return experiment
+        ]
+        
+        return ab_framework.create_experiment(
+            name="SVM Weight Test",
+            description="Test if increasing SVM weight improves conversions",
+            variants=variants,
+            metrics=['ctr', 'conversion_rate', 'revenue'],
+            duration_days=14
+        )
     
-    def test_create_experiment(self, ab_framework):
+    def test_create_experiment(self, app, ab_framework):
         """Test creating an A/B test experiment"""
         variants = [
             ExperimentVariant(
@@ -86,7 +109,7 @@ class TestABTestingFramework:
         assert len(experiment.variants) == 2
         assert experiment.status == 'draft'
     
-    def test_invalid_traffic_percentages(self, ab_framework):
+    def test_invalid_traffic_percentages(self, app, ab_framework):
         """Test that invalid traffic percentages are rejected"""
         variants = [
             ExperimentVariant(
@@ -111,17 +134,17 @@ class TestABTestingFramework:
                 metrics=['ctr']
             )
     
-    def test_start_experiment(self, app, ab_framework, sample_experiment):
+    def test_start_experiment(self, app, ab_framework, fresh_experiment):
         """Test starting an experiment"""
         with app.app_context():
-            ab_framework.start_experiment(sample_experiment.id)
+            ab_framework.start_experiment(fresh_experiment.id)
             
             # Reload experiment
-            experiment = ABTestExperiment.query.get(sample_experiment.id)
+            experiment = ABTestExperiment.query.get(fresh_experiment.id)
             
             assert experiment.status == 'running'
             assert experiment.start_date is not None
-            assert sample_experiment.id in ab_framework.active_experiments
+            assert fresh_experiment.id in ab_framework.active_experiments
     
     def test_user_variant_assignment(self, app, ab_framework, sample_experiment):
         """Test that users are consistently assigned to variants"""
@@ -167,29 +190,37 @@ class TestABTestingFramework:
             assert result.purchases == 1
             assert result.revenue == 99.99
     
-    def test_calculate_significance(self, app, ab_framework, sample_experiment, sample_users):
+    def test_calculate_significance(self, app, ab_framework, sample_experiment):
         """Test statistical significance calculation"""
         with app.app_context():
             ab_framework.start_experiment(sample_experiment.id)
             
-            # Simulate results for multiple users
+            # Simulate results for 40 users, enough to fill both variants
             # Control: 20% conversion rate
             # Treatment: 30% conversion rate
-            for i, user in enumerate(sample_users[:40]):
-                variant = ab_framework.get_user_variant(user.id, sample_experiment.id)
+            for i, user_id in enumerate(range(1, 41)):
+                variant = ab_framework.get_user_variant(user_id, sample_experiment.id)
                 
                 # Track recommendation shown
-                ab_framework.track_event(user.id, sample_experiment.id, 'recommendation_shown', 10)
+                ab_framework.track_event(user_id, sample_experiment.id, 'recommendation_shown', 10)
                 
                 # Simulate different conversion rates
                 if variant == 'control':
                     if i % 5 == 0:  # 20% convert
-                        ab_framework.track_event(user.id, sample_experiment.id, 'click')
-                        ab_framework.track_event(user.id, sample_experiment.id, 'purchase', 50.0)
+                        ab_framework.track_event(user_id, sample_experiment.id, 'click')
+                        ab_framework.track_event(user_id, sample_experiment.id, 'purchase', 50.0)
                 else:  # svm_heavy
                     if i % 3 == 0:  # 33% convert
-                        ab_framework.track_event(user.id, sample_experiment.id, 'click')
-                        ab_framework.track_event(user.id, sample_experiment.id, 'purchase', 50.0)
+                        ab_framework.track_event(user_id, sample_experiment.id, 'click')
+                        ab_framework.track_event(user_id, sample_experiment.id, 'purchase', 50.0)
+            
+            # One SELECT for every user's counters
+            results_by_user = {
+                r.user_id: r for r in ABTestResult.query.filter_by(experiment_id=sample_experiment.id)
+            }
+            assert set(results_by_user) == set(range(1, 41))
+            assert all(r.recommendations_shown == 10 for r in results_by_user.values())
+            assert all(r.clicks == r.purchases for r in results_by_user.values())
             
             # Calculate significance
             results = ab_framework.calculate_significance(sample_experiment.id)
@@ -203,6 +234,27 @@ class TestABTestingFramework:
             assert 'lift' in svm_heavy_data
             assert 'p_value' in svm_heavy_data
     
+    def test_significance_aggregates_in_one_query(self, app, ab_framework, sample_experiment, sql_queries):
+        """Test that per-variant totals come from one grouped query"""
+        with app.app_context():
+            ab_framework.start_experiment(sample_experiment.id)
+            for user_id in range(1, 21):
+                ab_framework.track_event(user_id, sample_experiment.id, 'recommendation_shown', 5)
+                if user_id % 4 == 0:
+                    ab_framework.track_event(user_id, sample_experiment.id, 'purchase', 30.0)
+            
+            sql_queries.clear()
+            results = ab_framework.calculate_significance(sample_experiment.id)
+            
+            result_queries = [q for q in sql_queries if 'FROM ab_test_results' in q]
+            assert len(result_queries) == 1
+            assert 'GROUP BY ab_test_results.variant' in result_queries[0]
+            
+            totals = results['variants']
+            assert sum(v['users'] for v in totals.values()) == 20
+            assert sum(v['purchases'] for v in totals.values()) == 5
+            assert sum(v['revenue'] for v in totals.values()) == pytest.approx(150.0)
+    
     def test_experiment_report(self, app, ab_framework, sample_experiment):
         """Test experiment report generation"""
         with app.app_context():
@@ -216,6 +268,12 @@ class TestABTestingFramework:
                 if user_id % 4 == 0:
                     ab_framework.track_event(user_id, sample_experiment.id, 'purchase', 30.0)
             
+            results_by_user = {
+                r.user_id: r for r in ABTestResult.query.filter_by(experiment_id=sample_experiment.id)
+            }
+            assert len(results_by_user) == 20
+            assert all(r.purchases == (user_id % 4 == 0) for user_id, r in results_by_user.items())
+            
             report = ab_framework.get_experiment_report(sample_experiment.id)
             
             assert 'experiment' in report
@@ -255,11 +313,12 @@ class TestABTestingFramework:
             
             # Simulate clear winner - winner variant has 50% conversion vs 10% for control
             for i in range(200):
-                # Ensure roughly equal split
                 user_id = i + 1000  # Offset to avoid conflicts
-                variant = 'control' if i % 2 == 0 else 'winner'
+                variant = ab_framework.get_user_variant(user_id, experiment.id)
+                
+                # Every user saw recommendations, converting or not
+                ab_framework.track_event(user_id, experiment.id, 'recommendation_shown', 5)
                 
-                # Force variant assignment
                 if variant == 'control':
                     # 10% conversion
                     if i % 10 == 0:
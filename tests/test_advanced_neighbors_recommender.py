@@ -7,7 +7,7 @@ import os
 # Add the src directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from eshop.models import UserInteraction
+from eshop.models import db, Category, Product, UserInteraction
 from eshop.ml_recommenders import AdvancedNeighborsRecommender
 
 
@@ -34,13 +34,11 @@ class TestAdvancedNeighborsRecommender:
         """Test extraction of user-item interaction scores"""
         user_id = 1
         
-        # Mock interaction data
+        # Mock weighted scores as summed by the query
         mock_interactions = [
-            (1, 'view', 3),      # Product 1: 3 views
-            (1, 'click', 2),     # Product 1: 2 clicks
-            (2, 'purchase', 1),  # Product 2: 1 purchase
-            (3, 'view', 5),      # Product 3: 5 views
-            (3, 'add_to_cart', 1)  # Product 3: 1 cart addition
+            (1, 7.0),  # Product 1: 3 views, 2 clicks
+            (2, 5.0),  # Product 2: 1 purchase
+            (3, 8.0)   # Product 3: 5 views, 1 cart addition
         ]
         
         with patch('eshop.models.db.session.query') as mock_query:
@@ -56,6 +54,56 @@ class TestAdvancedNeighborsRecommender:
             # Product 3: 5*1 + 1*3 = 8
             assert item_scores[3] == 8.0
     
+    def test_get_user_item_interactions_weights_in_sql(self, app, recommender, sample_users):
+        """Test that the database query applies the interaction weights"""
+        user = sample_users[0]
+        books = Category(name='Books', slug='books')
+        db.session.add(books)
+        db.session.flush()
+        
+        product = Product(name='Weighted Product', price=10.0, category='Books', category_id=books.id)
+        db.session.add(product)
+        db.session.flush()
+        
+        for interaction_type in ['view', 'view', 'view', 'click', 'click', 'purchase', 'wishlist']:
+            db.session.add(UserInteraction(
+                user_id=user.id,
+                product_id=product.id,
+                interaction_type=interaction_type
+            ))
+        db.session.commit()
+        
+        item_scores = recommender._get_user_item_interactions(user.id)
+        
+        # 3 views*1 + 2 clicks*2 + 1 purchase*5 + unknown type*1 = 13
+        assert item_scores == {product.id: 13.0}
+    
+    def test_get_users_item_interactions(self, app, recommender, sample_users):
+        """Test that several users' item scores are loaded in one query"""
+        books = Category(name='Books', slug='books')
+        db.session.add(books)
+        db.session.flush()
+        
+        product = Product(name='Shared Product', price=10.0, category='Books', category_id=books.id)
+        db.session.add(product)
+        db.session.flush()
+        
+        for user, interaction_type in [(sample_users[0], 'view'), (sample_users[0], 'purchase'),
+                                       (sample_users[1], 'click'), (sample_users[2], 'view')]:
+            db.session.add(UserInteraction(
+                user_id=user.id,
+                product_id=product.id,
+                interaction_type=interaction_type
+            ))
+        db.session.commit()
+        
+        users_items = recommender._get_users_item_interactions([sample_users[0].id, sample_users[1].id])
+        
+        # Only the requested users, with the same weighting as the single-user query
+        assert users_items[sample_users[0].id][product.id] == 6.0
+        assert users_items[sample_users[1].id][product.id] == 2.0
+        assert sample_users[2].id not in users_items
+    
     def test_calculate_user_similarity(self, recommender):
         """Test user similarity calculation"""
         # User 1 items and scores
@@ -93,39 +141,49 @@ class TestAdvancedNeighborsRecommender:
         user_id = 1
         user_items = {1: 5.0, 2: 3.0, 3: 4.0}
         
-        # Mock common users query
-        mock_common_users = [
-            (2, 1),  # User 2 interacted with product 1
-            (2, 2),  # User 2 interacted with product 2
-            (3, 1),  # User 3 interacted with product 1
-            (3, 3),  # User 3 interacted with product 3
-            (4, 1),  # User 4 interacted with product 1
+        # Mock other users' weighted scores on the target's items
+        mock_common_scores = [
+            (2, 1, 4.0),  # User 2 interacted with product 1
+            (2, 2, 5.0),  # User 2 interacted with product 2
+            (3, 1, 3.0),  # User 3 interacted with product 1
+            (3, 3, 5.0),  # User 3 interacted with product 3
+            (4, 1, 2.0),  # User 4 interacted with product 1
         ]
         
         with patch('eshop.models.db.session.query') as mock_query:
-            mock_query.return_value.filter.return_value.distinct.return_value.all.return_value = mock_common_users
+            mock_query.return_value.filter.return_value.group_by.return_value.all.return_value = mock_common_scores
             
-            # Mock get_user_item_interactions for other users
-            def mock_get_interactions(uid):
-                if uid == 2:
-                    return {1: 4.0, 2: 5.0, 4: 2.0}
-                elif uid == 3:
-                    return {1: 3.0, 3: 5.0, 5: 1.0}
-                elif uid == 4:
-                    return {1: 2.0, 6: 3.0}
-                return {}
+            similar_users = recommender._find_similar_users(user_id, user_items)
             
-            with patch.object(recommender, '_get_user_item_interactions', side_effect=mock_get_interactions):
-                similar_users = recommender._find_similar_users(user_id, user_items)
-                
-                # Should find users 2 and 3 (they have >= 2 common items)
-                # User 4 should be excluded (only 1 common item)
-                assert len(similar_users) == 2
-                assert all(uid in [2, 3] for uid, _ in similar_users)
-                
-                # Check that users are sorted by similarity
-                similarities = [sim for _, sim in similar_users]
-                assert similarities == sorted(similarities, reverse=True)
+            # Should find users 2 and 3 (they have >= 2 common items)
+            # User 4 should be excluded (only 1 common item)
+            assert len(similar_users) == 2
+            assert all(uid in [2, 3] for uid, _ in similar_users)
+            
+            # Check that users are sorted by similarity
+            similarities = [sim for _, sim in similar_users]
+            assert similarities == sorted(similarities, reverse=True)
+    
+    def test_find_similar_users_top_k_neighbors(self):
+        """Test that only the top_k_neighbors most similar users are kept"""
+        recommender = AdvancedNeighborsRecommender(
+            min_common_items=2,
+            similarity_threshold=0.1,
+            top_k_neighbors=1
+        )
+        user_items = {1: 5.0, 2: 3.0, 3: 4.0}
+        
+        mock_common_scores = [
+            (2, 1, 4.0), (2, 2, 5.0),  # User 2: ~0.94 similarity
+            (3, 1, 1.0), (3, 3, 5.0),  # User 3: ~0.77 similarity
+        ]
+        
+        with patch('eshop.models.db.session.query') as mock_query:
+            mock_query.return_value.filter.return_value.group_by.return_value.all.return_value = mock_common_scores
+            
+            similar_users = recommender._find_similar_users(1, user_items)
+            
+            assert [uid for uid, _ in similar_users] == [2]
     
     def test_get_neighbor_recommendations(self, recommender, sample_products):
         """Test getting recommendations from neighbors"""
@@ -133,25 +191,23 @@ class TestAdvancedNeighborsRecommender:
         similar_users = [(2, 0.9), (3, 0.7), (4, 0.5)]
         
         # Mock user's existing items
-        with patch.object(recommender, '_get_user_item_interactions') as mock_get_items:
+        with patch.object(recommender, '_get_user_item_interactions') as mock_get_items, \
+             patch.object(recommender, '_get_users_item_interactions') as mock_get_neighbor_items:
             # User 1 already has products 1, 2
-            def mock_interactions(uid):
-                if uid == 1:
-                    return {1: 5.0, 2: 3.0}
-                elif uid == 2:
-                    return {1: 4.0, 3: 5.0, 4: 3.0}  # Recommends 3, 4
-                elif uid == 3:
-                    return {2: 3.0, 3: 4.0, 5: 5.0}  # Recommends 3, 5
-                elif uid == 4:
-                    return {1: 2.0, 4: 4.0, 5: 2.0}  # Recommends 4, 5
-                return {}
-            
-            mock_get_items.side_effect = mock_interactions
+            mock_get_items.return_value = {1: 5.0, 2: 3.0}
+            mock_get_neighbor_items.return_value = {
+                2: {1: 4.0, 3: 5.0, 4: 3.0},  # Recommends 3, 4
+                3: {2: 3.0, 3: 4.0, 5: 5.0},  # Recommends 3, 5
+                4: {1: 2.0, 4: 4.0, 5: 2.0}   # Recommends 4, 5
+            }
             
             recommendations = recommender._get_neighbor_recommendations(
                 user_id, similar_users, sample_products[:6], limit=3
             )
             
+            # All neighbors' items are loaded in one call
+            mock_get_neighbor_items.assert_called_once_with([2, 3, 4])
+            
             # Should recommend products 3, 4, 5 (not 1, 2 which user already has)
             assert len(recommendations) <= 3
             recommended_ids = [p.id for p in recommendations]
@@ -161,6 +217,20 @@ class TestAdvancedNeighborsRecommender:
             # Check that products have scores attached
             assert all(hasattr(p, '_neighbor_score') for p in recommendations)
     
+    def test_get_neighbor_recommendations_reuses_user_items(self, recommender, sample_products):
+        """Test that already loaded user items are not fetched again"""
+        with patch.object(recommender, '_get_user_item_interactions') as mock_get_items, \
+             patch.object(recommender, '_get_users_item_interactions',
+                          return_value={2: {3: 5.0, 4: 3.0}}) as mock_get_neighbor_items:
+            recommendations = recommender._get_neighbor_recommendations(
+                1, [(2, 0.9)], sample_products[:6], limit=3, user_items={1: 5.0, 2: 3.0}
+            )
+            
+            # Only the neighbor's items were looked up
+            mock_get_items.assert_not_called()
+            mock_get_neighbor_items.assert_called_once_with([2])
+            assert [p.id for p in recommendations] == [3, 4]
+    
     def test_cold_start_handling(self, recommender, sample_products):
         """Test handling of users with insufficient interactions"""
         user_id = 1
@@ -195,26 +265,16 @@ class TestAdvancedNeighborsRecommender:
         )
         
         # Mock data
-        mock_common_users = [
-            (2, 1), (2, 2),  # User 2 has 2 common items
-            (3, 1), (3, 2),  # User 3 has 2 common items
+        mock_common_scores = [
+            (2, 1, 1.0), (2, 2, 5.0),  # User 2 has 2 common items, very different scores
+            (3, 1, 5.0), (3, 2, 3.0),  # User 3 has 2 common items, same scores (high similarity)
         ]
         
         with patch('eshop.models.db.session.query') as mock_query:
-            mock_query.return_value.filter.return_value.distinct.return_value.all.return_value = mock_common_users
+            mock_query.return_value.filter.return_value.group_by.return_value.all.return_value = mock_common_scores
             
-            # Mock interactions with low similarity
-            def mock_get_interactions(uid):
-                if uid == 2:
-                    return {1: 1.0, 2: 1.0}  # Very different scores
-                elif uid == 3:
-                    return {1: 5.0, 2: 3.0}  # Same scores (high similarity)
-                return {}
+            similar_users = high_threshold_recommender._find_similar_users(user_id, user_items)
             
-            with patch.object(high_threshold_recommender, '_get_user_item_interactions', 
-                            side_effect=mock_get_interactions):
-                similar_users = high_threshold_recommender._find_similar_users(user_id, user_items)
-                
-                # Only user 3 should pass the high threshold
-                assert len(similar_users) == 1
-                assert similar_users[0][0] == 3
\ No newline at end of file
+            # Only user 3 should pass the high threshold
+            assert len(similar_users) == 1
+            assert similar_users[0][0] == 3
\ No newline at end of file
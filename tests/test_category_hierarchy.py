@@ -109,7 +109,7 @@ class TestCategoryHierarchy:
             db.session.commit()
             
             assert product.category_id == category.id
-            assert product.category.name == "Electronics"
+            assert product.category_obj.name == "Electronics"
             assert product in category.products.all()
     
     def test_category_all_products(self, app):
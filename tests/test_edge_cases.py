@@ -5,7 +5,8 @@ Tests unusual scenarios and boundary conditions
 
 import pytest
 from datetime import datetime, timedelta
-from eshop.models import db, User, Product, UserInteraction, Order, OrderItem
+from sqlalchemy import insert
+from eshop.models import db, User, Category, Product, UserInteraction, Order, OrderItem, PersonalizedOffer
 from eshop.hybrid_recommender import HybridRecommender
 from eshop.ml_recommenders import LinearSVMRecommender, AdvancedNeighborsRecommender
 from eshop.shopping_cart_recommender import ShoppingCartRecommender
@@ -44,6 +45,10 @@ class TestAlgorithmEdgeCases:
             user.set_password('password')
             db.session.add(user)
             
+            electronics = Category(name='Electronics', slug='electronics')
+            db.session.add(electronics)
+            db.session.flush()
+            
             # Create identical products
             products = []
             for i in range(10):
@@ -51,6 +56,7 @@ class TestAlgorithmEdgeCases:
                     name=f'Identical Product {i}',
                     price=100.0,  # Same price
                     category='Electronics',  # Same category
+                    category_id=electronics.id,
                     brand='BrandA',  # Same brand
                     tags='tag1,tag2',  # Same tags
                     stock_quantity=100
@@ -88,6 +94,10 @@ class TestAlgorithmEdgeCases:
                 users.append(user)
                 db.session.add(user)
             
+            test_category = Category(name='Test', slug='test')
+            db.session.add(test_category)
+            db.session.flush()
+            
             # Create products
             products = []
             for i in range(15):
@@ -95,6 +105,7 @@ class TestAlgorithmEdgeCases:
                     name=f'Product {i}',
                     price=50 + i * 10,
                     category='Test',
+                    category_id=test_category.id,
                     stock_quantity=100
                 )
                 products.append(product)
@@ -130,12 +141,17 @@ class TestAlgorithmEdgeCases:
             user.set_password('password')
             db.session.add(user)
             
+            test_category = Category(name='Test', slug='test')
+            db.session.add(test_category)
+            db.session.flush()
+            
             products = []
             for i in range(10):
                 product = Product(
                     name=f'Product {i}',
                     price=100,
                     category='Test',
+                    category_id=test_category.id,
                     stock_quantity=100
                 )
                 products.append(product)
@@ -170,7 +186,7 @@ class TestAlgorithmEdgeCases:
             # Should return empty (no associations)
             assert recommendations == []
     
-    def test_hybrid_with_extreme_user_segments(self, app):
+    def test_hybrid_with_extreme_user_segments(self, app, sample_products):
         """Test hybrid recommender with extreme user behaviors"""
         with app.app_context():
             # User with exactly 5 interactions (boundary)
@@ -199,12 +215,29 @@ class TestAlgorithmEdgeCases:
             
             recommendations = hybrid.get_recommendations(user.id, limit=5)
             assert len(recommendations) <= 5
+    
+    def test_hybrid_batch_recommendations(self, app, sample_users, sample_products, sample_interactions):
+        """Test batched hybrid recommendations segment users like the per-user path"""
+        with app.app_context():
+            hybrid = HybridRecommender()
+            user_ids = [user.id for user in sample_users]
+            
+            segments = hybrid._determine_user_segments(user_ids)
+            assert segments == {
+                user_id: hybrid._determine_user_segment(user_id) for user_id in user_ids
+            }
+            
+            batch = hybrid.get_recommendations_batch(user_ids + user_ids[:1], limit=5)
+            assert list(batch) == user_ids
+            assert all(len(recommendations) <= 5 for recommendations in batch.values())
+            
+            assert hybrid.get_recommendations_batch([], limit=5) == {}
 
 
 class TestDataQualityEdgeCases:
     """Test algorithms with poor quality or unusual data"""
     
-    def test_recommendations_with_future_timestamps(self, app):
+    def test_recommendations_with_future_timestamps(self, app, sample_products):
         """Test when interactions have future timestamps"""
         with app.app_context():
             user = User(email='timetravel@test.com')
@@ -232,11 +265,16 @@ class TestDataQualityEdgeCases:
     def test_recommendations_with_negative_prices(self, app):
         """Test recommendations when products have invalid prices"""
         with app.app_context():
+            test_category = Category(name='Test', slug='test')
+            db.session.add(test_category)
+            db.session.flush()
+            
             # Create product with negative price
             weird_product = Product(
                 name='Negative Price Product',
                 price=-50.0,  # Invalid
                 category='Test',
+                category_id=test_category.id,
                 stock_quantity=100
             )
             db.session.add(weird_product)
@@ -246,6 +284,7 @@ class TestDataQualityEdgeCases:
                 name='Free Product',
                 price=0.0,
                 category='Test',
+                category_id=test_category.id,
                 stock_quantity=100
             )
             db.session.add(free_product)
@@ -259,7 +298,7 @@ class TestDataQualityEdgeCases:
             recommendations = hybrid.get_recommendations(1, limit=5)
             assert isinstance(recommendations, list)
     
-    def test_circular_purchase_patterns(self, app):
+    def test_circular_purchase_patterns(self, app, sample_products):
         """Test when users have circular purchase patterns"""
         with app.app_context():
             # Create users and products
@@ -307,7 +346,7 @@ class TestDataQualityEdgeCases:
 class TestScalabilityEdgeCases:
     """Test algorithms with extreme scale"""
     
-    def test_user_with_thousands_of_interactions(self, app):
+    def test_user_with_thousands_of_interactions(self, app, sample_products):
         """Test recommendations for power user with many interactions"""
         with app.app_context():
             user = User(email='poweruser@test.com')
@@ -316,19 +355,17 @@ class TestScalabilityEdgeCases:
             
             products = Product.query.limit(50).all()
             
-            # Add 1000 interactions
-            for i in range(1000):
-                interaction = UserInteraction(
-                    user_id=user.id,
-                    product_id=products[i % len(products)].id,
-                    interaction_type=['view', 'click', 'purchase'][i % 3],
-                    timestamp=datetime.utcnow() - timedelta(hours=i)
-                )
-                db.session.add(interaction)
-                
-                if i % 100 == 0:
-                    db.session.flush()  # Batch commits
-            
+            # Add 1000 interactions in one executemany
+            now = datetime.utcnow()
+            db.session.execute(insert(UserInteraction), [
+                {
+                    'user_id': user.id,
+                    'product_id': products[i % len(products)].id,
+                    'interaction_type': ['view', 'click', 'purchase'][i % 3],
+                    'timestamp': now - timedelta(hours=i)
+                }
+                for i in range(1000)
+            ])
             db.session.commit()
             
             # Test performance
@@ -393,7 +430,7 @@ class TestScalabilityEdgeCases:
 class TestConcurrencyEdgeCases:
     """Test concurrent access scenarios"""
     
-    def test_simultaneous_offer_generation(self, app):
+    def test_simultaneous_offer_generation(self, app, sample_users, sample_products):
         """Test when multiple processes try to generate offers simultaneously"""
         with app.app_context():
             from eshop.offers import OfferGenerator
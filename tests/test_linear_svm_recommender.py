@@ -21,7 +21,7 @@ class TestLinearSVMRecommender:
         return LinearSVMRecommender()
     
     @pytest.fixture
-    def sample_user(self):
+    def sample_user(self, app):
         """Create a sample user for testing"""
         user = Mock(spec=User)
         user.id = 1
@@ -29,7 +29,7 @@ class TestLinearSVMRecommender:
         return user
     
     @pytest.fixture
-    def sample_products(self):
+    def sample_products(self, app):
         """Create sample products for testing"""
         products = []
         categories = ['Electronics', 'Books', 'Clothing', 'Home']
@@ -41,6 +41,7 @@ class TestLinearSVMRecommender:
             product.category = categories[i % 4]
             product.brand = f"Brand {i % 3}"
             product.tags = f"tag{i % 2},tag{i % 3}"
+            product.get_tags_list.return_value = product.tags.split(',')
             products.append(product)
         return products
     
@@ -142,7 +143,9 @@ class TestLinearSVMRecommender:
         
         # Mock the database queries
         with patch.object(recommender, '_get_user_interactions', return_value=interactions):
-            with patch.object(recommender, '_get_user_purchases', return_value=[p.id for p in sample_products[:5]]):
+            with patch.object(recommender, '_get_user_purchases', return_value=[p.id for p in sample_products[:5]]), \
+                 patch('eshop.models.User.query') as mock_user_query:
+                mock_user_query.get.return_value = sample_user
                 model = recommender._train_user_model(sample_user.id)
                 
                 # Assertions
@@ -156,7 +159,13 @@ class TestLinearSVMRecommender:
         mock_model = Mock()
         mock_model.decision_function.return_value = np.array([0.8, -0.2, 0.5, 0.9, -0.5])
         
-        with patch.object(recommender, '_train_user_model', return_value=mock_model):
+        with patch.object(recommender, '_train_user_model', return_value=mock_model), \
+             patch.object(recommender, '_get_user_interactions', return_value=[]), \
+             patch('eshop.models.UserInteraction.query') as mock_query, \
+             patch('eshop.models.User.query') as mock_user_query:
+            mock_query.filter_by.return_value.count.return_value = 10
+            mock_user_query.get.return_value = sample_user
+            
             # Get top 3 recommendations
             recommendations = recommender.get_recommendations(sample_user.id, sample_products[:5], limit=3)
             
@@ -167,6 +176,25 @@ class TestLinearSVMRecommender:
             scores = [p._svm_score for p in recommendations]
             assert scores == sorted(scores, reverse=True)
     
+    def test_precomputed_user_vec_skips_reload(self, recommender, sample_user, sample_products):
+        """Test that a precomputed user vector is reused instead of reloading the user"""
+        mock_model = Mock()
+        mock_model.decision_function.return_value = np.array([0.8, -0.2, 0.5])
+        user_vec = ([], recommender._extract_user_features(sample_user, []))
+        
+        with patch.object(recommender, '_train_user_model', return_value=mock_model) as mock_train, \
+             patch.object(recommender, 'build_user_vector') as mock_build, \
+             patch('eshop.models.UserInteraction.query') as mock_query:
+            mock_query.filter_by.return_value.count.return_value = 10
+            
+            recommendations = recommender.get_recommendations(
+                sample_user.id, sample_products[:3], limit=2, precomputed_user_vec=user_vec
+            )
+            
+            mock_build.assert_not_called()
+            mock_train.assert_called_once_with(sample_user.id, *user_vec)
+            assert [p.id for p in recommendations] == [sample_products[0].id, sample_products[2].id]
+    
     def test_cold_start_handling(self, recommender, sample_user, sample_products):
         """Test handling of new users with no interactions"""
         # Mock no interactions
@@ -5,7 +5,7 @@ Tests for recommendation system accuracy metrics
 import pytest
 from tests.mock_data_generator import RecommendationMetrics, MockDataGenerator
 from eshop.hybrid_recommender import HybridRecommender
-from eshop.models import UserInteraction, OrderItem, Order
+from eshop.models import db, UserInteraction, OrderItem, Order
 
 
 class TestRecommendationMetrics:
@@ -94,7 +94,7 @@ class TestRecommendationMetrics:
             if len(recommendations) >= 5:
                 assert diversity > 0.1  # At least some diversity
     
-    def test_coverage_metric(self, app, sample_users, sample_products):
+    def test_coverage_metric(self, app, sample_users, sample_products, sample_interactions, sample_orders):
         """Test catalog coverage metric"""
         with app.app_context():
             # Get recommendations for multiple users
@@ -158,9 +158,9 @@ class TestAccuracyOverTime:
                         product_id=product.id,
                         interaction_type='view' if i % 3 else 'click'
                     )
-                    app.db.session.add(interaction)
+                    db.session.add(interaction)
                 
-                app.db.session.commit()
+                db.session.commit()
                 
                 # Get new recommendations
                 recs = hybrid.get_recommendations(user.id, limit=10)
@@ -24,13 +24,12 @@ def timer(name):
 class TestPerformanceBenchmarks:
     """Benchmark tests for recommendation system performance"""
     
-    @pytest.fixture(scope='class')
+    @pytest.fixture
     def large_dataset(self, app):
         """Generate a large dataset for performance testing"""
-        with app.app_context():
-            generator = MockDataGenerator()
-            data = generator.generate_complete_test_dataset()
-            return data
+        # Seeded so every run benchmarks the same data
+        generator = MockDataGenerator(seed=42)
+        return generator.generate_complete_test_dataset()
     
     def test_hybrid_recommender_performance(self, app, large_dataset):
         """Benchmark hybrid recommender with various user types"""
@@ -64,13 +63,17 @@ class TestPerformanceBenchmarks:
             svm = LinearSVMRecommender()
             users = large_dataset['users']
             
-            # Test with users having different amounts of data
-            test_users = [u for u in users if hasattr(u, '_mock_type') and u._mock_type == 'vip'][:3]
+            # Test with VIP users who bought enough distinct products to train on
+            test_users = [
+                u for u in users
+                if getattr(u, '_mock_type', None) == 'vip' and len(set(svm._get_user_purchases(u.id))) >= 3
+            ][:3]
+            assert test_users
             
             for user in test_users:
                 with timer(f"SVM training for user {user.id}"):
                     model = svm._train_user_model(user.id)
-                    assert model is not None or user.id == test_users[0].id
+                    assert model is not None
     
     def test_neighbors_search_performance(self, app, large_dataset):
         """Benchmark neighbor search algorithm"""
@@ -151,8 +154,8 @@ class TestPerformanceBenchmarks:
     
     def test_memory_usage(self, app, large_dataset):
         """Test memory usage of recommendation algorithms"""
-        import psutil
         import os
+        psutil = pytest.importorskip('psutil')
         
         process = psutil.Process(os.getpid())
         
@@ -180,4 +183,4 @@ class TestPerformanceBenchmarks:
             print(f"Memory increase: {memory_increase:.2f} MB")
             
             # Memory increase should be reasonable
-            assert memory_increase < 500  # Less than 500MB increase
\ No newline at end of file
+            assert memory_increase < 500  # Less than 500MB increase
@@ -0,0 +1,70 @@
+"""
+SQL query-count guards for the storefront pages
+"""
+
+import pytest
+from eshop.models import db, Product, Category
+
+
+class TestQueryCounts:
+    """Guard the main storefront pages against N+1 query regressions"""
+    
+    @pytest.fixture
+    def catalog(self, app):
+        """Create a main category with one subcategory of discounted products"""
+        parent = Category(name='Query Count Electronics', slug='query-count-electronics')
+        db.session.add(parent)
+        db.session.flush()
+        
+        child = Category(name='Query Count Phones', slug='query-count-phones', parent_id=parent.id)
+        db.session.add(child)
+        db.session.flush()
+        
+        products = [
+            Product(
+                name=f'Query Count Phone {i}',
+                price=100.0 + i,
+                category='Electronics',
+                category_id=child.id,
+                stock_quantity=5 + i,
+                discount_percentage=10 if i % 2 else 0
+            )
+            for i in range(30)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        
+        # The per-test transaction rollback removes these rows afterwards
+        return {'slug': parent.slug, 'product_ids': [p.id for p in products]}
+    
+    def test_home_query_count(self, client, catalog, sql_queries):
+        """Guest homepage should not load products one by one"""
+        sql_queries.clear()
+        response = client.get('/')
+        
+        assert response.status_code == 200
+        assert len(sql_queries) <= 10
+    
+    def test_product_detail_query_count(self, client, catalog, sql_queries):
+        """Product page should load its category breadcrumb with the product"""
+        sql_queries.clear()
+        response = client.get(f"/product/{catalog['product_ids'][0]}")
+        
+        assert response.status_code == 200
+        assert len(sql_queries) <= 6
+    
+    def test_category_query_count(self, client, catalog, sql_queries):
+        """Category page should not grow with the number of products listed"""
+        sql_queries.clear()
+        response = client.get(f"/category/{catalog['slug']}")
+        
+        assert response.status_code == 200
+        assert len(sql_queries) <= 10
+    
+    def test_deals_query_count(self, client, catalog, sql_queries):
+        """Deals page should not lazy-load products per deal"""
+        sql_queries.clear()
+        response = client.get('/deals')
+        
+        assert response.status_code == 200
+        assert len(sql_queries) <= 6
@@ -7,14 +7,14 @@ from unittest.mock import patch
 from eshop.recommender import Recommender
 from eshop.hybrid_recommender import HybridRecommender
 from eshop.offers import OfferGenerator
-from eshop.models import UserInteraction, GuestInteraction, PersonalizedOffer
+from eshop.models import db, UserInteraction, GuestInteraction, PersonalizedOffer
 from datetime import datetime, timedelta
 
 
 class TestRecommendationIntegration:
     """Integration tests for the full recommendation pipeline"""
     
-    def test_guest_initial_recommendations(self, app, client, sample_products, analytics_engine):
+    def test_guest_initial_recommendations(self, app, client, sample_products, sample_interactions, analytics_engine):
         """Test recommendations for new guest users"""
         with app.app_context():
             # Mock session ID
@@ -42,8 +42,8 @@ class TestRecommendationIntegration:
                     interaction_type='view',
                     timestamp=datetime.utcnow() - timedelta(minutes=i)
                 )
-                app.db.session.add(interaction)
-            app.db.session.commit()
+                db.session.add(interaction)
+            db.session.commit()
             
             # Get recommendations
             recommendations = Recommender.get_recommendations_for_guest(mock_session_id, limit=4)
@@ -106,6 +106,32 @@ class TestRecommendationIntegration:
                 assert offer.discount_percentage == 10.0
                 assert offer.expires_at > datetime.utcnow()
     
+    def test_bulk_offer_prices_match_single_lookup(self, app, sample_users, sample_products, sample_interactions):
+        """Test that bulk offer pricing matches per-product offer pricing"""
+        with app.app_context():
+            user = sample_users[2]  # Active user
+            
+            offer_gen = OfferGenerator()
+            offer_gen.generate_offers_for_user(user.id, num_offers=4)
+            
+            prices = offer_gen.bulk_apply(sample_products, user.id)
+            
+            assert set(prices) == {product.id for product in sample_products}
+            for product in sample_products:
+                expected_price, _ = offer_gen.apply_offer_to_product_price(product, user.id)
+                assert prices[product.id] == pytest.approx(expected_price)
+    
+    def test_batch_segments_match_single_lookup(self, app, sample_users, sample_interactions, sample_orders):
+        """Test that batched segmenting agrees with the per-user segment lookup"""
+        with app.app_context():
+            hybrid = HybridRecommender()
+            user_ids = [user.id for user in sample_users]
+            
+            segments = hybrid._determine_user_segments(user_ids)
+            
+            assert segments == {user_id: hybrid._determine_user_segment(user_id) for user_id in user_ids}
+            assert set(segments.values()) == {'new_user', 'minimal_data', 'established_user'}
+    
     def test_offer_application_in_checkout(self, app, authenticated_client, sample_products):
         """Test that offers are applied during checkout"""
         with app.app_context():
@@ -137,7 +163,7 @@ class TestRecommendationIntegration:
             # Should have at least 2 different categories in top 8
             assert len(unique_categories) >= 2
     
-    def test_algorithm_weight_determination(self, app, sample_users):
+    def test_algorithm_weight_determination(self, app, sample_users, sample_interactions, sample_orders):
         """Test correct algorithm weights for different user segments"""
         with app.app_context():
             hybrid = HybridRecommender()
@@ -198,8 +224,8 @@ class TestRecommendationAccuracy:
                     interaction_type='view',
                     timestamp=datetime.utcnow()
                 )
-                app.db.session.add(interaction)
-            app.db.session.commit()
+                db.session.add(interaction)
+            db.session.commit()
             
             # Get recommendations
             recommendations = Recommender.get_cold_start_recommendations(user.id, limit=4)
@@ -1,14 +1,33 @@
 import pytest
+import numpy as np
+from scipy import sparse
 from unittest.mock import Mock, patch
 from datetime import datetime, timedelta
+from sqlalchemy import insert
 import sys
 import os
 
 # Add the src directory to the path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from eshop.models import db, OrderItem, CartItem
+from eshop.models import db, Order, OrderItem, CartItem, Product
 from eshop.ml_recommenders import ShoppingCartRecommender
+from eshop.shopping_cart_recommender import Scored, get_cached_assoc
+
+
+def association_data(associations, product_counts, total_orders):
+    """Build the tuple returned by _get_association_data from plain dicts"""
+    product_ids = sorted(set(product_counts) | {pid for pair in associations for pid in pair})
+    product_index = {product_id: i for i, product_id in enumerate(product_ids)}
+    counts = np.array([product_counts.get(product_id, 1) for product_id in product_ids], dtype=np.int32)
+    
+    rows = [product_index[a] for a, b in associations]
+    cols = [product_index[b] for a, b in associations]
+    matrix = sparse.csr_matrix(
+        (list(associations.values()), (rows, cols)),
+        shape=(len(product_ids), len(product_ids))
+    )
+    return matrix, counts, product_index, total_orders
 
 
 class TestShoppingCartRecommender:
@@ -47,19 +66,20 @@ class TestShoppingCartRecommender:
             (4, [2, 3, 4])
         ]
         
-        associations = recommender._build_association_matrix(mock_associations)
+        product_index = {product_id: i for i, product_id in enumerate(range(1, 6))}
+        associations = recommender._build_association_matrix(mock_associations, product_index)
         
         # Check co-occurrence counts
         # Products 1 and 3 appear together in 2 orders
-        assert associations.get((1, 3), 0) == 2
-        assert associations.get((3, 1), 0) == 2
+        assert associations[product_index[1], product_index[3]] == 2
+        assert associations[product_index[3], product_index[1]] == 2
         
         # Products 2 and 4 appear together in 2 orders
-        assert associations.get((2, 4), 0) == 2
-        assert associations.get((4, 2), 0) == 2
+        assert associations[product_index[2], product_index[4]] == 2
+        assert associations[product_index[4], product_index[2]] == 2
         
         # Products 1 and 4 never appear together
-        assert associations.get((1, 4), 0) == 0
+        assert associations[product_index[1], product_index[4]] == 0
     
     def test_calculate_association_score(self, recommender):
         """Test association score calculation with confidence and lift"""
@@ -77,14 +97,16 @@ class TestShoppingCartRecommender:
             3: 8    # Product 3 appears in 8 orders
         }
         
-        total_orders = 100
+        associations, product_counts, product_index, total_orders = association_data(
+            associations, product_counts, 100
+        )
         
         # Calculate scores
         score_1_2 = recommender._calculate_association_score(
-            1, 2, associations, product_counts, total_orders
+            1, 2, associations, product_counts, product_index, total_orders
         )
         score_1_3 = recommender._calculate_association_score(
-            1, 3, associations, product_counts, total_orders
+            1, 3, associations, product_counts, product_index, total_orders
         )
         
         # Product 1->2 should have higher confidence than 1->3
@@ -106,24 +128,25 @@ class TestShoppingCartRecommender:
         mock_product_counts = {i: 10 + i for i in range(1, 11)}
         
         with patch.object(recommender, '_get_association_data', 
-                         return_value=(mock_associations, mock_product_counts, 100)):
+                         return_value=association_data(mock_associations, mock_product_counts, 100)):
             recommendations = recommender.get_cart_recommendations(
                 cart_product_ids, 
                 sample_products,
-                limit=5
+                limit=5,
+                with_scores=True
             )
             
             # Should not recommend products already in cart
-            recommended_ids = [p.id for p in recommendations]
+            recommended_ids = [s.product.id for s in recommendations]
             assert 1 not in recommended_ids
             assert 3 not in recommended_ids
             assert 5 not in recommended_ids
             
             # Should have association scores
-            assert all(hasattr(p, '_cart_association_score') for p in recommendations)
+            assert all(isinstance(s, Scored) and s.score > 0 for s in recommendations)
             
             # Scores should be sorted in descending order
-            scores = [p._cart_association_score for p in recommendations]
+            scores = [s.score for s in recommendations]
             assert scores == sorted(scores, reverse=True)
     
     def test_get_complementary_products(self, recommender, sample_products):
@@ -141,7 +164,7 @@ class TestShoppingCartRecommender:
         mock_product_counts = {1: 15, 2: 12, 3: 10, 4: 8, 5: 5}
         
         with patch.object(recommender, '_get_association_data',
-                         return_value=(mock_associations, mock_product_counts, 50)):
+                         return_value=association_data(mock_associations, mock_product_counts, 50)):
             complementary = recommender.get_complementary_products(
                 product_id,
                 sample_products[:6],
@@ -175,17 +198,18 @@ class TestShoppingCartRecommender:
         with patch.object(recommender, '_get_user_purchase_history',
                          return_value=mock_purchase_history):
             with patch.object(recommender, '_get_association_data',
-                             return_value=(mock_associations, {i: 10 for i in range(1, 11)}, 100)):
+                             return_value=association_data(mock_associations, {i: 10 for i in range(1, 11)}, 100)):
                 recommendations = recommender.get_abandoned_cart_recovery(
                     user_id,
                     abandoned_cart_items,
                     sample_products,
-                    limit=4
+                    limit=4,
+                    with_scores=True
                 )
                 
                 # Should prioritize products associated with both history and abandoned items
                 assert len(recommendations) <= 4
-                assert all(hasattr(p, '_recovery_score') for p in recommendations)
+                assert all(s.score > 0 for s in recommendations)
     
     def test_empty_cart_handling(self, recommender, sample_products):
         """Test handling of empty cart"""
@@ -214,7 +238,7 @@ class TestShoppingCartRecommender:
         }
         
         with patch.object(recommender, '_get_association_data',
-                         return_value=(mock_associations, {i: 10 for i in range(1, 12)}, 100)):
+                         return_value=association_data(mock_associations, {i: 10 for i in range(1, 12)}, 100)):
             recommendations = recommender.get_cart_recommendations(
                 cart_product_ids,
                 sample_products,
@@ -229,6 +253,19 @@ class TestShoppingCartRecommender:
             # Should have products from multiple categories
             assert len(unique_categories) > 1
     
+    def test_select_top_k_ties_at_boundary_keep_candidate_order(self, recommender):
+        """Test that scores tied at the k-th value are taken in candidate order"""
+        products = []
+        for i in range(1, 21):
+            product = Mock()
+            product.id = i
+            products.append(product)
+        product_scores = {p.id: (2.0 if p.id in (5, 17) else 1.0) for p in products}
+
+        top = recommender._select_top_k(product_scores, products, 4)
+
+        assert [p.id for p in top] == [5, 17, 1, 2]
+
     def test_time_decay_in_associations(self, recommender):
         """Test that recent associations are weighted more heavily"""
         # Mock order data with timestamps
@@ -267,4 +304,126 @@ class TestShoppingCartRecommender:
         assert (1, 2) in filtered
         assert (2, 4) in filtered
         assert (1, 3) not in filtered
-        assert (3, 4) not in filtered
\ No newline at end of file
+        assert (3, 4) not in filtered
+
+
+class TestAssociationCache:
+    """Test that cached association data follows committed order changes"""
+    
+    def test_core_and_bulk_order_writes_refresh_scores(self, app, sample_users, sample_products, sample_orders):
+        """Test that Core inserts and bulk deletes invalidate the association cache"""
+        recommender = ShoppingCartRecommender()
+        cart = [sample_products[5].id]
+        
+        # Product 5 is bought with others only once each, below min_support
+        assert recommender.get_cart_recommendations(cart, sample_products, limit=5) == []
+        assert get_cached_assoc() is get_cached_assoc()
+        
+        # Two more orders pair product 5 with product 9, written through Core
+        order_ids = db.session.scalars(
+            insert(Order).returning(Order.id, sort_by_parameter_order=True),
+            [{'user_id': sample_users[0].id, 'total': 20.0} for _ in range(2)]
+        ).all()
+        db.session.execute(insert(OrderItem), [
+            {'order_id': order_id, 'product_id': product.id, 'quantity': 1, 'price': product.price}
+            for order_id in order_ids
+            for product in (sample_products[5], sample_products[9])
+        ])
+        db.session.commit()
+        
+        recommendations = recommender.get_cart_recommendations(cart, sample_products, limit=5)
+        assert recommendations == [sample_products[9]]
+        
+        # A bulk delete removes the pairing again
+        OrderItem.query.filter(OrderItem.product_id == sample_products[9].id).delete()
+        db.session.commit()
+        
+        assert recommender.get_cart_recommendations(cart, sample_products, limit=5) == []
+    
+    def test_rolled_back_orders_are_not_cached(self, app, sample_users, sample_products, sample_orders):
+        """Test that uncommitted orders are neither shared nor cached"""
+        recommender = ShoppingCartRecommender()
+        cart = [sample_products[5].id]
+        cached = get_cached_assoc()
+        
+        order_ids = db.session.scalars(
+            insert(Order).returning(Order.id, sort_by_parameter_order=True),
+            [{'user_id': sample_users[0].id, 'total': 20.0} for _ in range(2)]
+        ).all()
+        db.session.execute(insert(OrderItem), [
+            {'order_id': order_id, 'product_id': product.id, 'quantity': 1, 'price': product.price}
+            for order_id in order_ids
+            for product in (sample_products[5], sample_products[9])
+        ])
+        
+        # The writing session sees its own orders without touching the cache
+        assert recommender.get_cart_recommendations(cart, sample_products, limit=5) == [sample_products[9]]
+        
+        db.session.rollback()
+        
+        assert get_cached_assoc() is cached
+        assert recommender.get_cart_recommendations(cart, sample_products, limit=5) == []
+
+
+class TestCandidateRowCache:
+    """Test that cached candidate rows follow committed product changes"""
+    
+    def test_product_writes_refresh_candidate_rows(self, app, sample_products):
+        """Test that edits and delete-then-insert refresh the rows"""
+        recommender = ShoppingCartRecommender()
+        rows = recommender._get_candidate_rows()
+        assert recommender._get_candidate_rows() is rows
+        
+        # An edit that keeps the product count
+        product = db.session.get(Product, sample_products[0].id)
+        product.category = 'Garden'
+        db.session.commit()
+        assert dict(recommender._get_candidate_rows())[product.id] == 'Garden'
+        
+        # A bulk delete followed by a Core insert, also keeping the count
+        deleted_id = sample_products[1].id
+        Product.query.filter(Product.id == deleted_id).delete()
+        new_id = db.session.scalars(
+            insert(Product).returning(Product.id),
+            [{'name': 'New Product', 'price': 5.0, 'category': 'Books',
+              'category_id': sample_products[1].category_id}]
+        ).one()
+        db.session.commit()
+        
+        candidate_ids = {row.id for row in recommender._get_candidate_rows()}
+        assert deleted_id not in candidate_ids
+        assert new_id in candidate_ids
+
+
+class TestPurchaseHistory:
+    """Test purchase history lookups against the database"""
+    
+    def test_abandoned_cart_excludes_all_past_purchases(self, app, sample_users, sample_products):
+        """Test that purchases older than the scored ones are still excluded"""
+        user = sample_users[2]
+        now = datetime.utcnow()
+        
+        # Seven single-item orders, oldest first
+        for days_ago, product in zip(range(7, 0, -1), sample_products[:7]):
+            order = Order(user_id=user.id, total=product.price, created_at=now - timedelta(days=days_ago))
+            db.session.add(order)
+            db.session.flush()
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, price=product.price))
+        db.session.commit()
+        
+        recommender = ShoppingCartRecommender()
+        history = recommender._get_user_purchase_history(user.id)
+        assert history == [p.id for p in reversed(sample_products[:7])]
+        
+        # Every candidate is associated with the abandoned item
+        abandoned = sample_products[10]
+        associations = {(abandoned.id, p.id): 5 for p in sample_products[:10]}
+        counts = {p.id: 10 for p in sample_products[:11]}
+        
+        with patch.object(recommender, '_get_association_data',
+                          return_value=association_data(associations, counts, 100)):
+            recommendations = recommender.get_abandoned_cart_recovery(
+                user.id, [abandoned.id], sample_products[:10], limit=10
+            )
+        
+        assert {p.id for p in recommendations} == {p.id for p in sample_products[7:10]}